@@ -11,7 +11,6 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), "src"))
 
 import config
-from rag_system import GeologicalRAGSystem
 
 
 def main():
@@ -35,6 +34,11 @@ def main():
         return
 
     try:
+        # Ленивый импорт: rag_system тянет sentence_transformers/torch
+        # (секунды на загрузку) - не платим за это при --help
+        # или при ненастроенном API ключе
+        from rag_system import GeologicalRAGSystem
+
         # Инициализация системы
         print("\n🚀 Загружаю систему...")
         rag = GeologicalRAGSystem()
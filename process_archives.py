@@ -4,6 +4,7 @@
 Поддерживает весь pipeline: извлечение → OCR → чанкинг → embeddings → индексация
 """
 
+import argparse
 import os
 import sys
 import time
@@ -13,8 +14,6 @@ from pathlib import Path
 # Добавляем src в путь для импорта модулей
 sys.path.append("src")
 
-from archive_processor import ArchiveProcessor
-
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(levelname)s - %(message)s",
@@ -25,9 +24,20 @@ logger = logging.getLogger(__name__)
 
 class ArchivePipeline:
     def __init__(self):
+        # Ленивый импорт: не тянем zipfile/tqdm-цепочку при --help
+        from archive_processor import ArchiveProcessor
+
         self.archive_processor = ArchiveProcessor()
         self.total_start_time = time.time()
 
+        # Прогреваем JIT-кэш численных kernels, чтобы компиляция
+        # не попала в горячий участок (шаг 5, поиск)
+        try:
+            import kernels
+            kernels.warm()
+        except Exception as e:
+            logger.debug(f"Прогрев kernels пропущен: {e}")
+
     def step1_extract_archives(self):
         """Шаг 1: Извлечение файлов из архивов"""
         logger.info("🗂️ === ШАГ 1: ИЗВЛЕЧЕНИЕ АРХИВОВ ===")
@@ -53,7 +63,7 @@ class ArchivePipeline:
 
         return True
 
-    def step2_ocr_processing(self, batch_size=5):
+    def step2_ocr_processing(self, workers=None):
         """Шаг 2: OCR обработка извлеченных файлов"""
         logger.info("📖 === ШАГ 2: OCR ОБРАБОТКА ===")
 
@@ -61,21 +71,27 @@ class ArchivePipeline:
 
         # Ленивый импорт
         from ocr_processor import process_extracted_files
+        from text_shard import TextShard
 
-        # Проверяем есть ли уже обработанные файлы для resume
-        extracted_text_dir = Path("data/extracted_text")
-        existing_files = []
-        if extracted_text_dir.exists():
-            existing_files = list(extracted_text_dir.glob("*.json"))
+        def count_extracted_texts():
+            """Всего извлеченных текстов: индекс zstd-шарда + legacy JSON"""
+            processed = TextShard().processed_ids()
+            extracted_text_dir = Path("data/extracted_text")
+            if extracted_text_dir.exists():
+                processed |= {p.stem for p in extracted_text_dir.glob("*.json")}
+            return len(processed)
 
-        logger.info(f"📋 Найдено {len(existing_files)} уже обработанных файлов")
+        # Проверяем есть ли уже обработанные файлы для resume
+        logger.info(f"📋 Найдено {count_extracted_texts()} уже обработанных файлов")
 
-        results = process_extracted_files(batch_size=batch_size, resume_from=True)
+        results = process_extracted_files(workers=workers, resume_from=True)
 
         ocr_time = time.time() - start_time
 
-        # Проверяем общее количество файлов для обработки
-        total_text_files = len(list(extracted_text_dir.glob("*.json"))) if extracted_text_dir.exists() else 0
+        # Проверяем общее количество файлов для обработки:
+        # результаты пишутся в zstd-шард, per-file JSON остались
+        # только от старых запусков
+        total_text_files = count_extracted_texts()
 
         if total_text_files == 0:
             logger.error("OCR обработка не дала результатов - нет извлеченных текстов!")
@@ -183,16 +199,16 @@ class ArchivePipeline:
             logger.error(f"Ошибка при построении индекса: {e}")
             return False
 
-    def run_full_pipeline(self, batch_size=5, skip_steps=None):
+    def run_full_pipeline(self, workers=None, skip_steps=None):
         """Запуск полного pipeline обработки"""
         skip_steps = skip_steps or []
 
         logger.info("🚀 === ЗАПУСК ПОЛНОГО PIPELINE ОБРАБОТКИ АРХИВОВ ===")
-        logger.info(f"⚙️ Размер batch для OCR: {batch_size}")
+        logger.info(f"⚙️ Worker-процессов для OCR: {workers or os.cpu_count()}")
 
         steps = [
             (1, "extract_archives", self.step1_extract_archives),
-            (2, "ocr_processing", lambda: self.step2_ocr_processing(batch_size)),
+            (2, "ocr_processing", lambda: self.step2_ocr_processing(workers)),
             (3, "text_processing", self.step3_text_processing),
             (4, "create_embeddings", self.step4_create_embeddings),
             (5, "build_search_index", self.step5_build_search_index),
@@ -227,70 +243,43 @@ class ArchivePipeline:
 def main():
     """Главная функция с обработкой аргументов командной строки"""
 
+    parser = argparse.ArgumentParser(
+        description="🗂️ Обработка ZIP архивов с TIFF файлами: "
+                    "извлечение → OCR → чанкинг → embeddings → индексация"
+    )
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker-процессов для OCR (по умолчанию: все ядра)")
+    parser.add_argument("--skip", action="append", default=[], metavar="STEP",
+                        help="Пропустить шаг (extract_archives, ocr_processing, ...)")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Отладочный вывод по каждому изображению (DEBUG)")
+
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--extract-only", action="store_true", help="Только извлечение архивов")
+    mode.add_argument("--ocr-only", action="store_true", help="Только OCR обработка")
+    mode.add_argument("--index-only", action="store_true", help="Только построение индекса")
+
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    # Pipeline создаем после разбора аргументов: --help не должен
+    # тянуть импорты обработчиков
     pipeline = ArchivePipeline()
 
-    if len(sys.argv) == 1:
-        # Без аргументов - запуск полного pipeline
-        logger.info("Запуск полного pipeline (используйте --help для справки)")
-        success = pipeline.run_full_pipeline()
-
-    elif "--help" in sys.argv or "-h" in sys.argv:
-        print("🗂️ ОБРАБОТКА АРХИВОВ - Справка по использованию")
-        print()
-        print("Команды:")
-        print("  python process_archives.py                    - Полный pipeline")
-        print("  python process_archives.py --batch 10         - С указанием размера batch")
-        print("  python process_archives.py --skip ocr         - Пропустить OCR")
-        print("  python process_archives.py --extract-only     - Только извлечение")
-        print("  python process_archives.py --ocr-only         - Только OCR")
-        print("  python process_archives.py --index-only       - Только индексация")
-        print()
-        print("Параметры:")
-        print("  --batch N      - Размер batch для OCR (по умолчанию 5)")
-        print("  --skip STEP    - Пропустить шаг (extract_archives, ocr_processing, etc.)")
-        print()
-        return
-
-    elif "--extract-only" in sys.argv:
+    if args.extract_only:
         logger.info("Запуск только извлечения архивов")
         success = pipeline.step1_extract_archives()
-
-    elif "--ocr-only" in sys.argv:
-        batch_size = 5
-        if "--batch" in sys.argv:
-            try:
-                batch_idx = sys.argv.index("--batch")
-                batch_size = int(sys.argv[batch_idx + 1])
-            except (IndexError, ValueError):
-                logger.warning("Неверный параметр --batch, используется значение по умолчанию: 5")
-
+    elif args.ocr_only:
         logger.info("Запуск только OCR обработки")
-        success = pipeline.step2_ocr_processing(batch_size)
-
-    elif "--index-only" in sys.argv:
+        success = pipeline.step2_ocr_processing(args.workers)
+    elif args.index_only:
         logger.info("Запуск только построения индекса")
         success = pipeline.step5_build_search_index()
-
     else:
-        # Полный pipeline с параметрами
-        batch_size = 5
-        skip_steps = []
-
-        if "--batch" in sys.argv:
-            try:
-                batch_idx = sys.argv.index("--batch")
-                batch_size = int(sys.argv[batch_idx + 1])
-            except (IndexError, ValueError):
-                logger.warning("Неверный параметр --batch, используется значение по умолчанию: 5")
-
-        if "--skip" in sys.argv:
-            try:
-                skip_idx = sys.argv.index("--skip")
-                skip_steps = [sys.argv[skip_idx + 1]]
-            except IndexError:
-                logger.warning("Неверный параметр --skip")
-
-        success = pipeline.run_full_pipeline(batch_size=batch_size, skip_steps=skip_steps)
+        logger.info("Запуск полного pipeline (используйте --help для справки)")
+        success = pipeline.run_full_pipeline(workers=args.workers, skip_steps=args.skip)
 
     if success:
         logger.info("🎉 Обработка завершена успешно!")
@@ -1,7 +1,10 @@
 import os
-import json
+import orjson
+import multiprocessing
+import re
 import zipfile
 import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from typing import List, Dict, Tuple
 from tqdm import tqdm
@@ -11,12 +14,197 @@ import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Прекомпилированный фильтр TIFF-записей: без .lower()-копии
+# полного пути для каждой записи архива
+TIFF_RE = re.compile(r'\.tiff?$', re.IGNORECASE)
+
+
+def _get_archive_id(archive_path: Path) -> str:
+    """Генерация уникального ID архива"""
+    return archive_path.stem.replace(" ", "_").replace("(", "").replace(")", "")
+
+
+def _generate_unique_file_id(archive_id: str, original_name: str, counter: int) -> str:
+    """Генерация уникального ID для файла"""
+    base_name = Path(original_name).stem
+    return f"{archive_id}_{counter:04d}_{base_name}"
+
+
+def _stored_entry_data_offset(fd_src: int, info: zipfile.ZipInfo):
+    """Смещение данных ZIP_STORED записи внутри файла архива
+
+    Длины имени и extra-поля берутся из локального заголовка (в
+    центральном каталоге они могут отличаться). None - если заголовок
+    не распознан.
+    """
+    os.lseek(fd_src, info.header_offset, os.SEEK_SET)
+    header = os.read(fd_src, 30)
+    if len(header) != 30 or header[:4] != b'PK\x03\x04':
+        return None
+    name_len = int.from_bytes(header[26:28], 'little')
+    extra_len = int.from_bytes(header[28:30], 'little')
+    return info.header_offset + 30 + name_len + extra_len
+
+
+def _copy_stored_entry(fd_src: int, info: zipfile.ZipInfo, extracted_path: Path) -> bool:
+    """Копирование несжатой записи через os.copy_file_range
+
+    Байты движутся внутри ядра без user-space буферов - вдвое меньше
+    трафика памяти. False - если запись не удалось скопировать так.
+    """
+    data_offset = _stored_entry_data_offset(fd_src, info)
+    if data_offset is None:
+        return False
+
+    os.lseek(fd_src, data_offset, os.SEEK_SET)
+    fd_dst = os.open(extracted_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        remaining = info.file_size
+        while remaining > 0:
+            copied = os.copy_file_range(fd_src, fd_dst, remaining)
+            if copied == 0:
+                return False
+            remaining -= copied
+    finally:
+        os.close(fd_dst)
+    return True
+
+
+def extract_tiff_files(archive_path: Path, extracted_dir: Path) -> Dict:
+    """Рекурсивное извлечение TIFF файлов из архива
+
+    Функция на уровне модуля (picklable), чтобы её можно было
+    выполнять в worker-процессах ProcessPoolExecutor.
+    """
+    archive_id = _get_archive_id(archive_path)
+    archive_dir = Path(extracted_dir) / archive_id
+    archive_dir.mkdir(exist_ok=True)
+
+    extracted_files = []
+    total_files = 0
+    skipped_files = 0
+
+    # Sidecar-индекс CRC32 уже извлеченных файлов: позволяет пропускать
+    # неизмененные записи при повторных запусках (resume шага 1)
+    crc_index_file = archive_dir / "crc_index.json"
+    crc_index = {}
+    if crc_index_file.exists():
+        try:
+            crc_index = orjson.loads(crc_index_file.read_bytes())
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать {crc_index_file}: {e}")
+
+    # Дескриптор архива для kernel-space копирования несжатых записей
+    fd_src = None
+    if hasattr(os, 'copy_file_range'):
+        try:
+            fd_src = os.open(archive_path, os.O_RDONLY)
+        except OSError:
+            fd_src = None
+
+    try:
+        with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+            all_infos = zip_ref.infolist()
+            tiff_infos = [info for info in all_infos if TIFF_RE.search(info.filename)]
+
+            logger.info(f"Архив {archive_path.name}: найдено {len(tiff_infos)} TIFF файлов из {len(all_infos)} общих")
+
+            stored_count = 0
+
+            for counter, file_info in enumerate(tiff_infos, 1):
+                file_path = file_info.filename
+                try:
+                    original_name = Path(file_path).name
+                    unique_id = _generate_unique_file_id(archive_id, original_name, counter)
+
+                    extracted_path = archive_dir / f"{unique_id}.tiff"
+
+                    # Пропускаем запись, если файл уже извлечен с тем же CRC32
+                    # (сверка размера - дешевая проверка без чтения данных)
+                    if (extracted_path.exists()
+                            and crc_index.get(unique_id) == file_info.CRC
+                            and extracted_path.stat().st_size == file_info.file_size):
+                        skipped_files += 1
+                    else:
+                        copied_in_kernel = False
+
+                        # ZIP_STORED - декомпрессия не нужна, остается чистый IO;
+                        # на Linux копируем такие записи внутри ядра
+                        if file_info.compress_type == zipfile.ZIP_STORED:
+                            stored_count += 1
+                            if fd_src is not None:
+                                try:
+                                    copied_in_kernel = _copy_stored_entry(
+                                        fd_src, file_info, extracted_path)
+                                except OSError:
+                                    copied_in_kernel = False
+
+                        if not copied_in_kernel:
+                            # Потоковое копирование вместо read()+write():
+                            # пиковая память O(буфер), а не O(размер TIFF)
+                            with zip_ref.open(file_info) as src, open(extracted_path, 'wb') as dst:
+                                shutil.copyfileobj(src, dst, length=1024 * 1024)
+
+                    crc_index[unique_id] = file_info.CRC
+
+                    extracted_files.append({
+                        "unique_id": unique_id,
+                        "original_path": file_path,
+                        "original_name": original_name,
+                        "extracted_path": str(extracted_path),
+                        "archive_source": str(archive_path),
+                        "file_size": file_info.file_size,
+                        "date_time": list(file_info.date_time)
+                    })
+
+                    total_files += 1
+
+                except Exception as e:
+                    logger.error(f"Ошибка при извлечении {file_path}: {e}")
+                    continue
+
+            if stored_count:
+                logger.info(f"Архив {archive_path.name}: {stored_count} файлов без сжатия (ZIP_STORED), "
+                            f"декомпрессия пропущена - узкое место только IO")
+
+            if skipped_files:
+                logger.info(f"Архив {archive_path.name}: {skipped_files} файлов уже извлечены "
+                            f"(CRC совпадает), пропущены")
+
+        # Атомарное обновление CRC-индекса
+        tmp_index = crc_index_file.with_suffix(".json.tmp")
+        tmp_index.write_bytes(orjson.dumps(crc_index))
+        os.replace(tmp_index, crc_index_file)
+
+    except Exception as e:
+        logger.error(f"Ошибка при открытии архива {archive_path}: {e}")
+        return {"archive_id": archive_id, "files": [], "error": str(e)}
+    finally:
+        if fd_src is not None:
+            os.close(fd_src)
+
+    logger.info(f"Успешно извлечено {total_files} файлов из архива {archive_path.name}")
+
+    return {
+        "archive_id": archive_id,
+        "archive_path": str(archive_path),
+        "files": extracted_files,
+        "total_files": total_files,
+        "extraction_time": time.time()
+    }
+
+
 class ArchiveProcessor:
     def __init__(self, archives_dir: str = "tiff_reports", extracted_dir: str = "data/extracted_files"):
         self.archives_dir = Path(archives_dir)
         self.extracted_dir = Path(extracted_dir)
         self.metadata_file = self.extracted_dir / "metadata.json"
-        
+
+        # Кэш метаданных в памяти: pipeline читает metadata.json
+        # многократно (OCR, чанкинг, embeddings)
+        self._metadata_cache: Dict = None
+        self._metadata_mtime: float = None
+
         self.extracted_dir.mkdir(parents=True, exist_ok=True)
         
     def scan_archives(self) -> List[Path]:
@@ -31,102 +219,60 @@ class ArchiveProcessor:
         logger.info(f"Найдено {len(zip_files)} ZIP архивов")
         return zip_files
     
-    def _get_archive_id(self, archive_path: Path) -> str:
-        """Генерация уникального ID архива"""
-        return archive_path.stem.replace(" ", "_").replace("(", "").replace(")", "")
-    
-    def _generate_unique_file_id(self, archive_id: str, original_name: str, counter: int) -> str:
-        """Генерация уникального ID для файла"""
-        base_name = Path(original_name).stem
-        return f"{archive_id}_{counter:04d}_{base_name}"
-    
     def extract_tiff_files(self, archive_path: Path) -> Dict:
-        """Рекурсивное извлечение TIFF файлов из архива"""
-        archive_id = self._get_archive_id(archive_path)
-        archive_dir = self.extracted_dir / archive_id
-        archive_dir.mkdir(exist_ok=True)
-        
-        extracted_files = []
-        total_files = 0
-        
-        try:
-            with zipfile.ZipFile(archive_path, 'r') as zip_ref:
-                file_list = zip_ref.namelist()
-                tiff_files = [f for f in file_list if f.lower().endswith(('.tiff', '.tif'))]
-                
-                logger.info(f"Архив {archive_path.name}: найдено {len(tiff_files)} TIFF файлов из {len(file_list)} общих")
-                
-                for counter, file_path in enumerate(tiff_files, 1):
-                    try:
-                        original_name = Path(file_path).name
-                        unique_id = self._generate_unique_file_id(archive_id, original_name, counter)
-                        
-                        file_info = zip_ref.getinfo(file_path)
-                        file_data = zip_ref.read(file_path)
-                        
-                        extracted_path = archive_dir / f"{unique_id}.tiff"
-                        
-                        with open(extracted_path, 'wb') as out_file:
-                            out_file.write(file_data)
-                        
-                        extracted_files.append({
-                            "unique_id": unique_id,
-                            "original_path": file_path,
-                            "original_name": original_name,
-                            "extracted_path": str(extracted_path),
-                            "archive_source": str(archive_path),
-                            "file_size": file_info.file_size,
-                            "date_time": list(file_info.date_time)
-                        })
-                        
-                        total_files += 1
-                        
-                    except Exception as e:
-                        logger.error(f"Ошибка при извлечении {file_path}: {e}")
-                        continue
-                        
-        except Exception as e:
-            logger.error(f"Ошибка при открытии архива {archive_path}: {e}")
-            return {"archive_id": archive_id, "files": [], "error": str(e)}
-        
-        logger.info(f"Успешно извлечено {total_files} файлов из архива {archive_path.name}")
-        
-        return {
-            "archive_id": archive_id,
-            "archive_path": str(archive_path),
-            "files": extracted_files,
-            "total_files": total_files,
-            "extraction_time": time.time()
-        }
-    
-    def process_all_archives(self) -> Dict:
-        """Batch обработка всех архивов"""
+        """Извлечение TIFF файлов из одного архива (обертка над модульной функцией)"""
+        return extract_tiff_files(archive_path, self.extracted_dir)
+
+    def process_all_archives(self, max_workers: int = None) -> Dict:
+        """Batch обработка всех архивов
+
+        Архивы независимы друг от друга, поэтому извлечение распараллелено
+        по процессам: декомпрессия zlib + запись на диск масштабируются
+        почти линейно по ядрам.
+        """
         archives = self.scan_archives()
         if not archives:
             logger.warning("Архивы не найдены")
             return {"archives": [], "total_files": 0}
-        
+
+        max_workers = max_workers or os.cpu_count()
+
         all_metadata = {
             "archives": [],
             "total_archives": len(archives),
             "total_files": 0,
             "processing_time": time.time()
         }
-        
-        logger.info(f"Начинаю обработку {len(archives)} архивов...")
-        
-        for archive in tqdm(archives, desc="Обработка архивов"):
-            start_time = time.time()
-            logger.info(f"Обрабатываю архив: {archive.name}")
-            
-            archive_metadata = self.extract_tiff_files(archive)
-            archive_metadata["processing_time"] = time.time() - start_time
-            
-            all_metadata["archives"].append(archive_metadata)
-            all_metadata["total_files"] += archive_metadata.get("total_files", 0)
-            
-            logger.info(f"Архив {archive.name} обработан за {archive_metadata['processing_time']:.2f} сек")
-        
+
+        logger.info(f"Начинаю обработку {len(archives)} архивов ({max_workers} процессов)...")
+
+        start_times = {}
+        # spawn - безопасный контекст для macOS/Windows
+        mp_context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as executor:
+            futures = {}
+            for archive in archives:
+                start_times[archive] = time.time()
+                futures[executor.submit(extract_tiff_files, archive, self.extracted_dir)] = archive
+
+            with tqdm(total=len(archives), desc="Обработка архивов") as pbar:
+                for future in as_completed(futures):
+                    archive = futures[future]
+                    try:
+                        archive_metadata = future.result()
+                    except Exception as e:
+                        logger.error(f"Ошибка при обработке архива {archive.name}: {e}")
+                        archive_metadata = {"archive_id": _get_archive_id(archive), "files": [],
+                                            "total_files": 0, "error": str(e)}
+
+                    archive_metadata["processing_time"] = time.time() - start_times[archive]
+
+                    all_metadata["archives"].append(archive_metadata)
+                    all_metadata["total_files"] += archive_metadata.get("total_files", 0)
+
+                    logger.info(f"Архив {archive.name} обработан за {archive_metadata['processing_time']:.2f} сек")
+                    pbar.update(1)
+
         all_metadata["total_processing_time"] = time.time() - all_metadata["processing_time"]
         
         self._save_metadata(all_metadata)
@@ -137,20 +283,31 @@ class ArchiveProcessor:
         return all_metadata
     
     def _save_metadata(self, metadata: Dict):
-        """Сохранение метаданных в JSON"""
+        """Сохранение метаданных в JSON (атомарно, через os.replace)"""
         try:
-            with open(self.metadata_file, 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, ensure_ascii=False, indent=2)
+            tmp_file = self.metadata_file.with_suffix(".json.tmp")
+            tmp_file.write_bytes(orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
+            os.replace(tmp_file, self.metadata_file)
+
+            self._metadata_cache = metadata
+            self._metadata_mtime = os.path.getmtime(self.metadata_file)
+
             logger.info(f"Метаданные сохранены в {self.metadata_file}")
         except Exception as e:
             logger.error(f"Ошибка при сохранении метаданных: {e}")
-    
+
     def load_metadata(self) -> Dict:
-        """Загрузка метаданных"""
+        """Загрузка метаданных (с кэшем в памяти по mtime файла)"""
         if self.metadata_file.exists():
             try:
-                with open(self.metadata_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                mtime = os.path.getmtime(self.metadata_file)
+                if self._metadata_cache is not None and mtime == self._metadata_mtime:
+                    return self._metadata_cache
+
+                metadata = orjson.loads(self.metadata_file.read_bytes())
+                self._metadata_cache = metadata
+                self._metadata_mtime = mtime
+                return metadata
             except Exception as e:
                 logger.error(f"Ошибка при загрузке метаданных: {e}")
         return {}
@@ -166,6 +323,12 @@ class ArchiveProcessor:
         
         return all_files
     
+    def get_metadata_table(self):
+        """Колоночное (SoA) представление метаданных извлеченных файлов"""
+        from metadata_table import MetadataTable
+
+        return MetadataTable.from_metadata(self.load_metadata())
+
     def cleanup_extracted_files(self):
         """Очистка извлеченных файлов"""
         if self.extracted_dir.exists():
@@ -15,6 +15,19 @@ MAX_TOKENS_CONTEXT = 8000
 EMBEDDING_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
 # EMBEDDING_MODEL = "ai-forever/sbert_large_nlu_ru"
 
+# "onnx" - локальный ONNX Runtime (быстрее на CPU, без сети),
+# требует sentence-transformers>=3.2
+# "fastembed" - готовые int8 ONNX модели (VNNI на новых Intel CPU);
+# с ним используйте e5-модель, например:
+# EMBEDDING_MODEL = "intfloat/multilingual-e5-small"
+EMBEDDING_BACKEND = "torch"
+
+# Тип хранения матрицы индекса на диске. "float16" вдвое сокращает
+# файл и трафик при загрузке (нормализованные MiniLM-векторы теряют
+# точность пренебрежимо); "int8" - скалярное квантование, файл меньше
+# вчетверо; "float32" - хранение без конвертации
+EMBEDDING_INDEX_DTYPE = "float16"
+
 DATA_PATHS = {
     "tiff_reports": "tiff_reports/",
     "test_files": "test_files/",
@@ -0,0 +1,74 @@
+import os
+import hashlib
+import sqlite3
+from typing import Dict, Iterable, List
+import numpy as np
+import config
+
+
+class EmbeddingCache:
+    """Персистентный кэш эмбеддингов по хэшу содержимого чанка
+
+    При повторных запусках pipeline (resume, добавление нового архива)
+    неизмененные чанки не пересчитываются заново - вектор берется из
+    SQLite по blake2b-хэшу текста.
+    """
+
+    def __init__(self, db_path: str = None):
+        if db_path is None:
+            db_path = os.path.join(config.DATA_PATHS["embeddings"], "embedding_cache.db")
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "hash TEXT NOT NULL, "
+            "model TEXT NOT NULL, "
+            "dim INT NOT NULL, "
+            "vec BLOB NOT NULL, "
+            "PRIMARY KEY (hash, model))"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        """Хэш содержимого чанка (blake2b, 16 байт)"""
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+    def get_many(self, texts: Iterable[str], model: str) -> Dict[str, np.ndarray]:
+        """Batch-выборка кэшированных векторов, ключ - хэш текста"""
+        hashes = list({self.text_hash(t) for t in texts})
+        found = {}
+
+        # SQLite ограничивает число параметров в одном запросе
+        batch_size = 500
+        for i in range(0, len(hashes), batch_size):
+            batch = hashes[i:i + batch_size]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT hash, vec FROM embeddings WHERE model=? AND hash IN ({placeholders})",
+                [model] + batch,
+            )
+            for h, blob in rows:
+                found[h] = np.frombuffer(blob, dtype=np.float32)
+
+        return found
+
+    def put_many(self, texts: List[str], vectors: np.ndarray, model: str):
+        """UPSERT свежих векторов (float32 blob)"""
+        rows = []
+        for text, vec in zip(texts, vectors):
+            vec = np.asarray(vec, dtype=np.float32)
+            rows.append((self.text_hash(text), model, vec.shape[0], vec.tobytes()))
+
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (hash, model, dim, vec) VALUES (?, ?, ?, ?)",
+            rows,
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -1,125 +1,729 @@
 import os
-import json
+import orjson
 import pickle
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
 import config
+from embedding_cache import EmbeddingCache
+
+try:
+    # Parquet-шарды: колоночный формат в 3-10 раз компактнее JSON,
+    # векторы читаются zero-copy. Без pyarrow - пара JSON + .npy
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+try:
+    # Точный подсчет токенов для бюджета RAG-контекста; считается
+    # один раз на чанк при индексации, а не на каждый запрос
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+try:
+    # faiss сканирует скалярные произведения через AVX2 + OpenMP
+    # и решает проблему pickle-объектов >4 ГиБ через write_index
+    import faiss
+except ImportError:
+    faiss = None
+
+_TOKEN_ENCODER = None
+
+
+def count_tokens(text: str) -> int:
+    """Число cl100k_base-токенов в тексте
+
+    Без tiktoken - грубая оценка для смешанного русского/латинского
+    текста (~3 символа на токен).
+    """
+    global _TOKEN_ENCODER
+    if tiktoken is not None:
+        if _TOKEN_ENCODER is None:
+            _TOKEN_ENCODER = tiktoken.get_encoding("cl100k_base")
+        return len(_TOKEN_ENCODER.encode(text))
+    return len(text) // 3 + 1
+
+
+class FastEmbedEncoder:
+    """Обертка над fastembed.TextEmbedding с интерфейсом encode()
+
+    FastEmbed поставляет модели уже квантованными в int8 ONNX - на
+    современных CPU это в 3-4 раза быстрее FP32 torch при сопоставимом
+    качестве поиска. Для e5-моделей автоматически добавляются
+    обязательные префиксы "passage: " / "query: ".
+    """
+
+    def __init__(self, model_name: str):
+        from fastembed import TextEmbedding
+
+        self.model_name = model_name
+        self._model = TextEmbedding(model_name=model_name, threads=os.cpu_count())
+        self._needs_prefix = "e5" in model_name.lower()
+        # Префиксы фиксированы на все время жизни энкодера. Кэшировать
+        # активации префикса (KV-кэш) для bi-энкодера нельзя: attention
+        # двунаправленный, и состояния префикса зависят от всего текста
+        self._doc_prefix = "passage: "
+        self._query_prefix = "query: "
+
+    def encode(self, texts, is_query: bool = False, batch_size: int = 64, **kwargs):
+        if self._needs_prefix:
+            prefix = self._query_prefix if is_query else self._doc_prefix
+            texts = [prefix + text for text in texts]
+
+        vectors = list(self._model.embed(texts, batch_size=batch_size))
+        return np.array(vectors, dtype=np.float32)
+
+
+def load_sentence_transformer(model_name: str):
+    """Загрузка модели с учетом выбранного backend'а
+
+    При EMBEDDING_BACKEND="onnx" модель выполняется через ONNX Runtime
+    (CPU-оптимизированные графы, без torch overhead). Старые версии
+    sentence-transformers без поддержки backend тихо откатываются на torch.
+    """
+    backend = getattr(config, "EMBEDDING_BACKEND", "torch")
+    if backend == "fastembed":
+        return FastEmbedEncoder(model_name)
+    if backend != "torch":
+        try:
+            return SentenceTransformer(model_name, backend=backend)
+        except TypeError:
+            print(f"Backend '{backend}' не поддерживается этой версией "
+                  f"sentence-transformers, использую torch")
+
+    import torch
+
+    if torch.cuda.is_available():
+        # fp16 на GPU: вдвое меньше трафика памяти и тензорные ядра;
+        # для MiniLM-класса потери качества незаметны
+        model = SentenceTransformer(model_name, device="cuda")
+        model.half()
+        try:
+            # Компиляция графа трансформера: окупается на больших корпусах
+            model[0].auto_model = torch.compile(model[0].auto_model, mode="reduce-overhead")
+        except Exception as e:
+            print(f"torch.compile недоступен: {e}")
+        return model
+
+    # На CPU torch по умолчанию может не использовать все ядра
+    torch.set_num_threads(os.cpu_count())
+    return SentenceTransformer(model_name)
 
 class EmbeddingsCreator:
-    def __init__(self, model_name: str = None):
-        """Инициализация создателя эмбеддингов"""
+    # Минимальный размер батча, при котором стоит поднимать
+    # multi-process пул (его запуск сам стоит секунды)
+    MULTI_PROCESS_MIN_TEXTS = 5000
+
+    # С этого размера корпуса faiss-индекс строится как HNSW
+    # (приближенный поиск) вместо точного брутфорс-скана
+    HNSW_MIN_ROWS = 50_000
+
+    def __init__(self, model_name: str = None, use_cache: bool = True,
+                 target_devices: list = None):
+        """Инициализация создателя эмбеддингов
+
+        Args:
+            target_devices: устройства для multi-process кодирования,
+                например ['cuda:0', 'cuda:1'] или ['cpu'] * 4.
+                None - одиночный процесс
+        """
         self.model_name = model_name or config.EMBEDDING_MODEL
         print(f"Загружаю модель: {self.model_name}")
-        self.model = SentenceTransformer(self.model_name)
+        self.model = load_sentence_transformer(self.model_name)
         print("Модель загружена успешно!")
-    
-    def create_embeddings_for_chunks(self, chunks_data: list) -> list:
-        """Создание эмбеддингов для списка чанков"""
+
+        self.target_devices = target_devices
+        self.cache = EmbeddingCache() if use_cache else None
+
+    def _encode(self, texts: list, encode_kwargs: dict):
+        """Кодирование: один процесс или пул worker-процессов
+
+        Кодирование чанков embarrassingly parallel - с пулом процессов
+        оно масштабируется почти линейно по числу устройств.
+        """
+        use_pool = (self.target_devices
+                    and len(texts) >= self.MULTI_PROCESS_MIN_TEXTS
+                    and hasattr(self.model, "start_multi_process_pool"))
+        if not use_pool:
+            return self.model.encode(texts, **encode_kwargs)
+
+        print(f"Кодирую на {len(self.target_devices)} устройствах: {self.target_devices}")
+        pool = self.model.start_multi_process_pool(target_devices=self.target_devices)
+        try:
+            return self.model.encode_multi_process(
+                texts, pool,
+                batch_size=encode_kwargs.get("batch_size", 64),
+                chunk_size=5000,
+                normalize_embeddings=encode_kwargs.get("normalize_embeddings", True),
+            )
+        finally:
+            self.model.stop_multi_process_pool(pool)
+
+    def _encode_with_cache(self, texts: list):
+        """Кодирование текстов с использованием персистентного кэша
+
+        В модель отправляются только чанки, которых нет в кэше;
+        свежие векторы сразу записываются обратно.
+        """
+        # Явный batch_size + numpy-выход: smart batching (сортировка по
+        # длине внутри encode) не греет CPU/GPU на padding-токенах.
+        # Нормализация на этапе кодирования превращает косинусное
+        # сходство ниже по pipeline в чистое скалярное произведение
+        encode_kwargs = dict(
+            batch_size=64,
+            show_progress_bar=True,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        )
+
+        if self.cache is None:
+            return self._encode(texts, encode_kwargs)
+
+        cached = self.cache.get_many(texts, self.model_name)
+
+        uncached_texts = []
+        uncached_positions = []
+        for i, text in enumerate(texts):
+            if self.cache.text_hash(text) not in cached:
+                uncached_texts.append(text)
+                uncached_positions.append(i)
+
+        print(f"Кэш эмбеддингов: {len(texts) - len(uncached_texts)} из {len(texts)} чанков найдено")
+
+        if uncached_texts:
+            fresh = self._encode(uncached_texts, encode_kwargs)
+            self.cache.put_many(uncached_texts, fresh, self.model_name)
+        else:
+            fresh = []
+
+        embeddings = [None] * len(texts)
+        for pos, vec in zip(uncached_positions, fresh):
+            embeddings[pos] = np.asarray(vec, dtype=np.float32)
+        for i, text in enumerate(texts):
+            if embeddings[i] is None:
+                embeddings[i] = cached[self.cache.text_hash(text)]
+
+        return np.vstack(embeddings) if embeddings else np.empty((0, 0), dtype=np.float32)
+
+    def create_embeddings_for_chunks(self, chunks_data: list):
+        """Создание эмбеддингов для списка чанков
+
+        Embeddings остаются сплошной float32-матрицей (N, d): никаких
+        .tolist() и O(N*d) Python-объектов на пути к индексу.
+
+        Returns:
+            (chunks_meta, embeddings) - метаданные чанков без векторов
+            и матрица эмбеддингов
+        """
         texts = [chunk["text"] for chunk in chunks_data]
-        
+
         print(f"Создаю эмбеддинги для {len(texts)} чанков...")
-        embeddings = self.model.encode(texts, show_progress_bar=True)
-        
-        result = []
-        for chunk, embedding in zip(chunks_data, embeddings):
-            chunk_with_embedding = chunk.copy()
-            chunk_with_embedding["embedding"] = embedding.tolist()
-            chunk_with_embedding["embedding_dim"] = len(embedding)
-            result.append(chunk_with_embedding)
-        
-        return result
-    
+        embeddings = np.asarray(self._encode_with_cache(texts), dtype=np.float32)
+
+        chunks_meta = []
+        for chunk in chunks_data:
+            chunk_meta = chunk.copy()
+            chunk_meta["embedding_dim"] = embeddings.shape[1] if embeddings.size else 0
+            chunk_meta["token_count"] = count_tokens(chunk["text"])
+            chunks_meta.append(chunk_meta)
+
+        return chunks_meta, embeddings
+
+    def _write_shard(self, output_dir: str, file_id: str, chunks_meta: list,
+                     embeddings: np.ndarray):
+        """Запись одного шарда (метаданные чанков + матрица эмбеддингов)
+
+        С pyarrow шард пишется одним parquet-файлом: метаданные колонками,
+        векторы - FixedSizeList над сплошным float32-буфером (без
+        поэлементной конвертации). Иначе - пара JSON + .npy.
+        """
+        if pa is not None and embeddings.size:
+            table = pa.Table.from_pylist(chunks_meta)
+            flat = pa.array(np.ascontiguousarray(embeddings, dtype=np.float32).ravel(),
+                            type=pa.float32())
+            embedding_col = pa.FixedSizeListArray.from_arrays(flat, embeddings.shape[1])
+            table = table.append_column("embedding", embedding_col)
+
+            output_path = os.path.join(output_dir, f"{file_id}_embeddings.parquet")
+            pq.write_table(table, output_path)
+        else:
+            output_path = os.path.join(output_dir, f"{file_id}_embeddings.json")
+            # orjson без indent: сериализация и файл в разы компактнее
+            # stdlib json с indent=2 на этом горячем пути
+            with open(output_path, 'wb') as f:
+                f.write(orjson.dumps(chunks_meta))
+
+            np.save(os.path.join(output_dir, f"{file_id}_embeddings.npy"), embeddings)
+
+        print(f"Эмбеддинги сохранены: {output_path}")
+
     def process_chunks_file(self, file_path: str, output_dir: str):
         """Обработка одного файла с чанками"""
-        with open(file_path, 'r', encoding='utf-8') as f:
-            chunks_data = json.load(f)
-        
+        with open(file_path, 'rb') as f:
+            chunks_data = orjson.loads(f.read())
+
         file_id = os.path.splitext(os.path.basename(file_path))[0].replace('_chunks', '')
-        
+
         print(f"Обрабатываю файл: {file_id} ({len(chunks_data)} чанков)")
-        
-        chunks_with_embeddings = self.create_embeddings_for_chunks(chunks_data)
-        
-        output_path = os.path.join(output_dir, f"{file_id}_embeddings.json")
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(chunks_with_embeddings, f, ensure_ascii=False, indent=2)
-        
-        print(f"Эмбеддинги сохранены: {output_path}")
-        
+
+        chunks_meta, embeddings = self.create_embeddings_for_chunks(chunks_data)
+
+        self._write_shard(output_dir, file_id, chunks_meta, embeddings)
+
         return len(chunks_data)
     
     def process_all_chunks(self):
-        """Обработка всех файлов с чанками"""
+        """Обработка всех файлов с чанками
+
+        Тексты всех файлов кодируются одним вызовом encode: маленькие
+        файлы по отдельности не загружают ни CPU-векторизацию, ни GPU,
+        а один большой батч - загружает. Результат раскладывается
+        обратно по файлам через np.split по накопленным счетчикам.
+        """
         input_dir = config.DATA_PATHS["processed_chunks"]
         output_dir = config.DATA_PATHS["embeddings"]
-        
+
         os.makedirs(output_dir, exist_ok=True)
-        
-        chunks_files = [f for f in os.listdir(input_dir) if f.endswith('_chunks.json')]
-        
+
+        chunks_files = sorted(f for f in os.listdir(input_dir) if f.endswith('_chunks.json'))
+
         if not chunks_files:
             print("Файлы с чанками не найдены!")
             return
-        
+
         print(f"Найдено {len(chunks_files)} файлов с чанками")
-        
-        total_chunks = 0
-        for filename in tqdm(chunks_files, desc="Создание эмбеддингов"):
-            file_path = os.path.join(input_dir, filename)
-            chunks_count = self.process_chunks_file(file_path, output_dir)
-            total_chunks += chunks_count
-        
-        print(f"\nВсего обработано {total_chunks} чанков")
-        
-        self.create_search_index(output_dir)
-        
+
+        # Инкрементальность: файл с актуальным шардом (mtime шарда не
+        # старше исходника) не перекодируется - повторный запуск стоит
+        # O(новых файлов), а не O(корпуса)
+        pending_files = []
+        for filename in chunks_files:
+            src_mtime = os.path.getmtime(os.path.join(input_dir, filename))
+            file_id = filename.replace('_chunks.json', '')
+
+            shard_path = None
+            for ext in ('.parquet', '.json'):
+                candidate = os.path.join(output_dir, f"{file_id}_embeddings{ext}")
+                if os.path.exists(candidate):
+                    shard_path = candidate
+                    break
+
+            if shard_path is None or os.path.getmtime(shard_path) < src_mtime:
+                pending_files.append(filename)
+
+        # Если новых шардов нет и манифест индекса совпадает с каталогом,
+        # перестроение не нужно
+        manifest_path = os.path.join(output_dir, "index_manifest.json")
+        if not pending_files and os.path.exists(manifest_path):
+            manifest = orjson.loads(open(manifest_path, 'rb').read())
+            expected_ids = {f.replace('_chunks.json', '') + '_embeddings' for f in chunks_files}
+            if set(manifest.get("shards", {})) == expected_ids:
+                print("Все шарды актуальны, индекс не требует перестроения")
+                return manifest.get("total_chunks", 0)
+
+        if len(pending_files) < len(chunks_files):
+            print(f"Актуальных шардов: {len(chunks_files) - len(pending_files)}, "
+                  f"кодируются только {len(pending_files)}")
+        chunks_files = pending_files
+
+        if chunks_files:
+            # Один проход: собираем все тексты и границы файлов
+            per_file_chunks = []
+            all_texts = []
+            counts = []
+            for filename in chunks_files:
+                with open(os.path.join(input_dir, filename), 'rb') as f:
+                    chunks_data = orjson.loads(f.read())
+                per_file_chunks.append((filename, chunks_data))
+                all_texts.extend(chunk["text"] for chunk in chunks_data)
+                counts.append(len(chunks_data))
+
+            print(f"Создаю эмбеддинги для {len(all_texts)} чанков одним батчем...")
+            all_embeddings = np.asarray(self._encode_with_cache(all_texts), dtype=np.float32)
+
+            # Раскладываем матрицу обратно по файлам
+            split_points = np.cumsum(counts)[:-1]
+            per_file_embeddings = np.split(all_embeddings, split_points)
+
+            # Свежие шарды передаются построителю индекса напрямую:
+            # то, что только что было в памяти, не перечитывается с диска
+            in_memory_shards = {}
+
+            for (filename, chunks_data), embeddings in zip(per_file_chunks, per_file_embeddings):
+                file_id = filename.replace('_chunks.json', '')
+                embedding_dim = embeddings.shape[1] if embeddings.size else 0
+
+                chunks_meta = []
+                for chunk in chunks_data:
+                    chunk_meta = chunk.copy()
+                    chunk_meta["embedding_dim"] = embedding_dim
+                    chunk_meta["token_count"] = count_tokens(chunk["text"])
+                    chunks_meta.append(chunk_meta)
+
+                self._write_shard(output_dir, file_id, chunks_meta, embeddings)
+                in_memory_shards[f"{file_id}_embeddings"] = (chunks_meta, embeddings)
+
+            print(f"\nОбработано {len(all_texts)} новых чанков")
+        else:
+            in_memory_shards = {}
+
+        self.create_search_index(output_dir, in_memory_shards=in_memory_shards)
+
+        manifest = orjson.loads(open(manifest_path, 'rb').read())
+        total_chunks = manifest.get("total_chunks", 0)
+        print(f"Всего чанков в индексе: {total_chunks}")
+
         return total_chunks
     
-    def create_search_index(self, embeddings_dir: str):
-        """Создание поискового индекса из всех эмбеддингов"""
+    def create_search_index(self, embeddings_dir: str, in_memory_shards: dict = None):
+        """Создание поискового индекса из всех эмбеддингов
+
+        Матрица индекса выделяется один раз (предварительный проход по
+        .npy шардам дает итоговые N и d), после чего шарды копируются
+        в свои срезы через mmap - без промежуточных списков float'ов.
+
+        in_memory_shards: {shard_id: (chunks_meta, embeddings)} - шарды,
+        только что закодированные в этом же запуске; для них данные
+        берутся из памяти, а не перечитываются с диска.
+        """
         print("Создаю поисковый индекс...")
-        
+
+        in_memory_shards = in_memory_shards or {}
+        meta_fields = ("chunk_id", "file_id", "filename", "text", "chunk_index", "token_count")
+
+        # Каталог шардов по file_id: parquet (метаданные и векторы в
+        # одном файле), иначе JSON с .npy рядом либо старый JSON
+        # с векторами внутри
+        shard_kinds = {}
+        for filename in os.listdir(embeddings_dir):
+            if pa is not None and filename.endswith('_embeddings.parquet'):
+                shard_kinds[filename[:-len('.parquet')]] = 'parquet'
+            elif filename.endswith('_embeddings.json'):
+                shard_kinds.setdefault(filename[:-len('.json')], 'json')
+
+        shard_ids = sorted(shard_kinds)
+
+        # Предварительный проход: размеры шардов без чтения данных
+        shard_rows = {}
+        total_rows = 0
+        embedding_dim = 0
+        for shard_id in shard_ids:
+            if shard_id in in_memory_shards:
+                shape = in_memory_shards[shard_id][1].shape
+                shard_rows[shard_id] = shape[0]
+                if len(shape) > 1 and shape[1]:
+                    embedding_dim = shape[1]
+            elif shard_kinds[shard_id] == 'parquet':
+                parquet_file = pq.ParquetFile(os.path.join(embeddings_dir, shard_id + '.parquet'))
+                shard_rows[shard_id] = parquet_file.metadata.num_rows
+                embedding_dim = parquet_file.schema_arrow.field('embedding').type.list_size
+            else:
+                npy_path = os.path.join(embeddings_dir, shard_id + '.npy')
+                if os.path.exists(npy_path):
+                    shape = np.load(npy_path, mmap_mode='r').shape
+                    shard_rows[shard_id] = shape[0]
+                    if len(shape) > 1:
+                        embedding_dim = shape[1]
+            total_rows += shard_rows.get(shard_id, 0)
+
         all_chunks = []
-        all_embeddings = []
-        
-        embedding_files = [f for f in os.listdir(embeddings_dir) if f.endswith('_embeddings.json')]
-        
-        for filename in embedding_files:
-            file_path = os.path.join(embeddings_dir, filename)
-            with open(file_path, 'r', encoding='utf-8') as f:
-                chunks = json.load(f)
-            
-            for chunk in chunks:
-                all_chunks.append({
-                    "chunk_id": chunk["chunk_id"],
-                    "file_id": chunk["file_id"],
-                    "filename": chunk["filename"],
-                    "text": chunk["text"],
-                    "chunk_index": chunk["chunk_index"]
-                })
-                all_embeddings.append(chunk["embedding"])
-        
-        embeddings_array = np.array(all_embeddings, dtype=np.float32)
-        
+        shard_arrays = []
+        all_binary = len(shard_rows) == len(shard_ids)
+        embeddings_array = np.empty((total_rows, embedding_dim), dtype=np.float32)
+        row = 0
+
+        shard_counts = {}
+        for shard_id in shard_ids:
+            chunks_before = len(all_chunks)
+            shard = None
+            if shard_id in in_memory_shards:
+                chunks_meta, shard = in_memory_shards[shard_id]
+                for chunk in chunks_meta:
+                    all_chunks.append({name: chunk[name] for name in meta_fields if name in chunk})
+            elif shard_kinds[shard_id] == 'parquet':
+                table = pq.read_table(os.path.join(embeddings_dir, shard_id + '.parquet'))
+                # Шарды старых версий могут не иметь части колонок
+                present = [name for name in meta_fields if name in table.column_names]
+                columns = [table.column(name).to_pylist() for name in present]
+                for values in zip(*columns):
+                    all_chunks.append(dict(zip(present, values)))
+
+                flat = table.column('embedding').combine_chunks().values
+                shard = flat.to_numpy(zero_copy_only=False).reshape(-1, embedding_dim)
+            else:
+                with open(os.path.join(embeddings_dir, shard_id + '.json'), 'rb') as f:
+                    chunks = orjson.loads(f.read())
+
+                legacy_embeddings = []
+                for chunk in chunks:
+                    all_chunks.append({name: chunk[name] for name in meta_fields if name in chunk})
+                    # Старый формат: векторы внутри JSON
+                    if shard_id not in shard_rows and "embedding" in chunk:
+                        legacy_embeddings.append(chunk["embedding"])
+
+                if shard_id in shard_rows:
+                    shard = np.load(os.path.join(embeddings_dir, shard_id + '.npy'), mmap_mode='r')
+                elif legacy_embeddings:
+                    shard_arrays.append(np.array(legacy_embeddings, dtype=np.float32))
+                elif chunks:
+                    # Чанки без векторов сдвинули бы соответствие
+                    # строка<->чанк для всего индекса - падаем громко
+                    raise ValueError(
+                        f"Шард {shard_id}.json не содержит векторов: нет ни "
+                        f"inline-эмбеддингов, ни {shard_id}.npy рядом. "
+                        f"Посторонний файл в {embeddings_dir}?")
+
+            if shard is not None:
+                if all_binary:
+                    embeddings_array[row:row + shard.shape[0]] = shard
+                    row += shard.shape[0]
+                else:
+                    shard_arrays.append(np.asarray(shard, dtype=np.float32))
+
+            shard_counts[shard_id] = len(all_chunks) - chunks_before
+
+        if not all_binary:
+            # Смешанный каталог (старые JSON-шарды + бинарные):
+            # порядок строк сохраняется по порядку файлов
+            embeddings_array = (np.concatenate(shard_arrays, axis=0)
+                                if shard_arrays else np.empty((0, 0), dtype=np.float32))
+
+        # L2-нормализация на этапе индексации: косинусное сходство на
+        # запросе вырождается в одно матрично-векторное произведение
+        if embeddings_array.size:
+            norms = np.linalg.norm(embeddings_array, axis=1, keepdims=True).clip(min=1e-12)
+            embeddings_array = embeddings_array / norms
+
+        # Матрица эмбеддингов хранится отдельным .npy: pickle копирует
+        # NumPy-буфер через себя и ломается на объектах >4 ГиБ, а .npy
+        # пишется как raw memcpy и читается через mmap без копии.
+        # float16 на диске вдвое сокращает файл и трафик загрузки
+        store_dtype = getattr(config, "EMBEDDING_INDEX_DTYPE", "float32")
+        embeddings_file = "search_index_embeddings.npy"
+        int8_scale = None
+        if store_dtype == "int8" and embeddings_array.size:
+            # Скалярное квантование: по-координатный масштаб 127/max|x|,
+            # файл и трафик загрузки сокращаются вчетверо против float32
+            int8_scale = 127.0 / np.abs(embeddings_array).max(axis=0).clip(min=1e-12)
+            np.save(os.path.join(embeddings_dir, embeddings_file),
+                    np.round(embeddings_array * int8_scale).astype(np.int8))
+        else:
+            np.save(os.path.join(embeddings_dir, embeddings_file),
+                    embeddings_array.astype(store_dtype, copy=False))
+
         index_data = {
             "chunks": all_chunks,
-            "embeddings": embeddings_array,
+            "embeddings_file": embeddings_file,
             "model_name": self.model_name,
             "total_chunks": len(all_chunks),
-            "embedding_dim": embeddings_array.shape[1] if len(all_embeddings) > 0 else 0
+            "embedding_dim": embeddings_array.shape[1] if embeddings_array.size else 0,
+            "normalized": True
         }
-        
+        if int8_scale is not None:
+            index_data["int8_scale"] = int8_scale.astype(np.float32)
+
+        # Бинарная версия матрицы (знаковые биты, упакованные по 8 на
+        # байт): на больших корпусах поиск сначала отбирает кандидатов
+        # по расстоянию Хэмминга и только их пересчитывает в float32
+        if embeddings_array.size:
+            bits_file = "search_index_bits.npy"
+            np.save(os.path.join(embeddings_dir, bits_file),
+                    np.packbits(embeddings_array > 0, axis=1))
+            index_data["bits_file"] = bits_file
+
+        # С faiss пишем рядом индекс: на нормализованных векторах
+        # inner product = косинус. До HNSW_MIN_ROWS - точный IndexFlatIP
+        # (SIMD + OpenMP скан), дальше - HNSW: O(log N) на запрос при
+        # recall > 0.95 вместо линейного прохода по корпусу
+        if faiss is not None and embeddings_array.size:
+            matrix = np.ascontiguousarray(embeddings_array, dtype=np.float32)
+            if embeddings_array.shape[0] >= self.HNSW_MIN_ROWS:
+                if store_dtype == "int8":
+                    # Скалярное квантование внутри HNSW: графовый обход
+                    # по int8-кодам трогает вчетверо меньше байт
+                    faiss_index = faiss.IndexHNSWSQ(
+                        embeddings_array.shape[1], faiss.ScalarQuantizer.QT_8bit,
+                        32, faiss.METRIC_INNER_PRODUCT)
+                    faiss_index.train(matrix)
+                else:
+                    faiss_index = faiss.IndexHNSWFlat(
+                        embeddings_array.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+                faiss_index.hnsw.efConstruction = 200
+            else:
+                faiss_index = faiss.IndexFlatIP(embeddings_array.shape[1])
+            faiss_index.add(matrix)
+            faiss.write_index(faiss_index, os.path.join(embeddings_dir, "search.faiss"))
+            index_data["faiss_file"] = "search.faiss"
+
         index_path = os.path.join(embeddings_dir, "search_index.pkl")
         with open(index_path, 'wb') as f:
-            pickle.dump(index_data, f)
-        
+            pickle.dump(index_data, f, protocol=5)
+
+        # Манифест: какие шарды и сколько строк вошло в индекс -
+        # по нему process_all_chunks решает, нужно ли перестроение
+        manifest = {"shards": shard_counts, "total_chunks": len(all_chunks)}
+        with open(os.path.join(embeddings_dir, "index_manifest.json"), 'wb') as f:
+            f.write(orjson.dumps(manifest))
+
         print(f"Поисковый индекс создан: {index_path}")
         print(f"Всего чанков в индексе: {len(all_chunks)}")
         print(f"Размерность эмбеддингов: {index_data['embedding_dim']}")
         
         return index_path
 
+class OpenAIEmbeddingsCreator:
+    """Создание эмбеддингов через OpenAI API с batch-группировкой запросов
+
+    HTTP round-trip (~200мс) доминирует при отправке чанков по одному,
+    поэтому чанки группируются до 2048 текстов на один запрос. Для
+    первичной индексации большого корпуса есть путь через Batch API
+    (асинхронный, на 50% дешевле).
+    """
+
+    # Лимиты одного запроса embeddings API
+    MAX_BATCH_INPUTS = 2048
+    MAX_BATCH_TOKENS = 300_000
+
+    def __init__(self, model_name: str = "text-embedding-3-small", api_key: str = None):
+        import openai
+
+        api_key = api_key or config.OPENAI_API_KEY
+        if not api_key or api_key == "your_api_key_here":
+            raise ValueError("OpenAI API ключ не настроен! Добавьте ключ в .env файл.")
+
+        self.model_name = model_name
+        self.client = openai.OpenAI(api_key=api_key)
+
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        # Грубая оценка для смешанного русского/латинского текста
+        return len(text) // 3 + 1
+
+    def _iter_batches(self, texts: list):
+        """Группировка текстов: до 2048 входов или ~300k токенов на запрос"""
+        batch = []
+        batch_tokens = 0
+        for text in texts:
+            tokens = self._estimate_tokens(text)
+            if batch and (len(batch) >= self.MAX_BATCH_INPUTS
+                          or batch_tokens + tokens > self.MAX_BATCH_TOKENS):
+                yield batch
+                batch = []
+                batch_tokens = 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+
+    def embed_texts(self, texts: list) -> np.ndarray:
+        """Синхронное создание эмбеддингов, один запрос на batch"""
+        all_vectors = []
+        for batch in tqdm(list(self._iter_batches(texts)), desc="OpenAI embeddings"):
+            response = self.client.embeddings.create(model=self.model_name, input=batch)
+            all_vectors.extend(item.embedding for item in response.data)
+
+        return np.array(all_vectors, dtype=np.float32)
+
+    def embed_texts_concurrent(self, texts: list, max_concurrent_requests: int = 16) -> np.ndarray:
+        """Конкурентное создание эмбеддингов (когда Batch API не подходит)
+
+        Батчи отправляются параллельно через AsyncOpenAI под семафором,
+        с экспоненциальным backoff на 429/5xx и учетом
+        x-ratelimit-remaining-* заголовков ответа.
+        """
+        import asyncio
+        import openai
+
+        async_client = openai.AsyncOpenAI(api_key=self.client.api_key)
+        semaphore = asyncio.Semaphore(max_concurrent_requests)
+
+        async def embed_batch(batch_index: int, batch: list):
+            delay = 1.0
+            for attempt in range(6):
+                async with semaphore:
+                    try:
+                        raw = await async_client.embeddings.with_raw_response.create(
+                            model=self.model_name, input=batch
+                        )
+                        # Притормаживаем, когда лимит запросов почти исчерпан
+                        remaining = raw.headers.get("x-ratelimit-remaining-requests")
+                        if remaining is not None and int(remaining) < max_concurrent_requests:
+                            await asyncio.sleep(1.0)
+
+                        response = raw.parse()
+                        return batch_index, [item.embedding for item in response.data]
+                    except (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError):
+                        pass
+                await asyncio.sleep(delay)
+                delay *= 2
+            raise RuntimeError(f"Batch {batch_index}: лимит попыток исчерпан")
+
+        async def embed_all():
+            tasks = [embed_batch(i, batch) for i, batch in enumerate(self._iter_batches(texts))]
+            results = await asyncio.gather(*tasks)
+            await async_client.close()
+            return results
+
+        results = asyncio.run(embed_all())
+
+        all_vectors = []
+        for _, vectors in sorted(results):
+            all_vectors.extend(vectors)
+
+        return np.array(all_vectors, dtype=np.float32)
+
+    def submit_batch_job(self, texts: list, jsonl_path: str) -> str:
+        """Отправка корпуса через Batch API (асинхронно, завершение до 24ч)
+
+        Возвращает batch_id для последующего опроса статуса.
+        """
+        with open(jsonl_path, "wb") as f:
+            for batch_index, batch in enumerate(self._iter_batches(texts)):
+                row = {
+                    "custom_id": f"embed_batch_{batch_index:05d}",
+                    "method": "POST",
+                    "url": "/v1/embeddings",
+                    "body": {"model": self.model_name, "input": batch},
+                }
+                f.write(orjson.dumps(row) + b"\n")
+
+        with open(jsonl_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+
+        batch_job = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/embeddings",
+            completion_window="24h",
+        )
+
+        print(f"Batch задача отправлена: {batch_job.id}")
+        return batch_job.id
+
+    def fetch_batch_results(self, batch_id: str) -> np.ndarray:
+        """Получение результатов завершенной batch-задачи"""
+        batch_job = self.client.batches.retrieve(batch_id)
+        if batch_job.status != "completed":
+            raise RuntimeError(f"Batch задача не завершена: статус {batch_job.status}")
+
+        content = self.client.files.content(batch_job.output_file_id).read()
+
+        vectors_by_id = {}
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            row = orjson.loads(line)
+            body = row["response"]["body"]
+            vectors_by_id[row["custom_id"]] = [item["embedding"] for item in body["data"]]
+
+        all_vectors = []
+        for custom_id in sorted(vectors_by_id):
+            all_vectors.extend(vectors_by_id[custom_id])
+
+        return np.array(all_vectors, dtype=np.float32)
+
+
 def create_embeddings_for_test_data():
     """Создание эмбеддингов для тестовых данных"""
     creator = EmbeddingsCreator()
@@ -0,0 +1,125 @@
+import os
+import numpy as np
+
+try:
+    # Numba не входит в обязательные зависимости: без нее kernels
+    # прозрачно откатываются на numpy/BLAS
+    import numba
+    from numba import njit, prange
+except ImportError:
+    numba = None
+
+if numba is not None:
+    numba.set_num_threads(os.cpu_count())
+
+    @njit(cache=True)
+    def _chunk_bounds(breaks, n, chunk_size, overlap):
+        step = chunk_size - overlap
+        if step < 1:
+            step = 1
+        max_chunks = n // step + 2
+        starts = np.empty(max_chunks, dtype=np.int64)
+        ends = np.empty(max_chunks, dtype=np.int64)
+        count = 0
+        start = 0
+        while start < n:
+            end = start + chunk_size
+            if end > n:
+                end = n
+            if end < n:
+                i = np.searchsorted(breaks, end) - 1
+                if i >= 0 and breaks[i] > start:
+                    end = breaks[i] + 1
+            starts[count] = start
+            ends[count] = end
+            count += 1
+            if end >= n:
+                break
+            new_start = start + chunk_size - overlap
+            if end - overlap > new_start:
+                new_start = end - overlap
+            start = new_start
+        return starts[:count], ends[:count]
+
+
+# Кэш специализированных ядер по размерности эмбеддинга
+_dot_kernels = {}
+
+
+def make_dot_kernel(dim: int):
+    """Ядро скалярных произведений, специализированное под размерность
+
+    Размерность эмбеддинга фиксирована на все время жизни индекса,
+    поэтому она зашивается в код константой замыкания: numba сворачивает
+    границу внутреннего цикла и раскатывает его в SIMD-ленты без
+    проверок на каждой итерации - в отличие от универсального GEMV с
+    диспетчеризацией на M=1. Компиляция происходит здесь же, на
+    крошечном массиве, чтобы не попасть в первый запрос.
+
+    Returns:
+        kernel(corpus, query) -> scores, либо None без numba
+    """
+    if numba is None:
+        return None
+
+    kernel = _dot_kernels.get(dim)
+    if kernel is None:
+        d = dim
+
+        @njit(fastmath=True, parallel=True)
+        def kernel(corpus, query):
+            n = corpus.shape[0]
+            scores = np.empty(n, dtype=np.float32)
+            for i in prange(n):
+                dot = np.float32(0.0)
+                for j in range(d):
+                    dot += corpus[i, j] * query[j]
+                scores[i] = dot
+            return scores
+
+        kernel(np.zeros((1, dim), dtype=np.float32),
+               np.zeros(dim, dtype=np.float32))
+        _dot_kernels[dim] = kernel
+
+    return kernel
+
+
+def chunk_bounds(breaks: np.ndarray, n: int, chunk_size: int, overlap: int):
+    """Границы чанков текста по отсортированным позициям разрывов
+
+    breaks - позиции символов-разрывов (пробел/перенос/точка) в тексте
+    длины n. С numba цикл скомпилирован в машинный код; без нее -
+    тот же алгоритм на Python с np.searchsorted.
+
+    Returns:
+        Список пар (start, end) - полуинтервалы чанков в символах
+    """
+    breaks = np.asarray(breaks, dtype=np.int64)
+
+    if numba is not None:
+        starts, ends = _chunk_bounds(breaks, n, chunk_size, overlap)
+        return list(zip(starts.tolist(), ends.tolist()))
+
+    bounds = []
+    start = 0
+    while start < n:
+        end = min(start + chunk_size, n)
+        if end < n:
+            i = np.searchsorted(breaks, end) - 1
+            if i >= 0 and breaks[i] > start:
+                end = int(breaks[i]) + 1
+        bounds.append((start, end))
+        if end >= n:
+            break
+        start = max(start + chunk_size - overlap, end - overlap)
+    return bounds
+
+
+def warm():
+    """Прогрев JIT-кэша перед горячим участком pipeline
+
+    Первый вызов njit-функции стоит секунды компиляции; прогоняем
+    ее на крошечных массивах, чтобы .nbc/.nbi кэш был готов до шага 5.
+    """
+    chunk_bounds(np.array([2], dtype=np.int64), 5, 3, 1)
+    make_dot_kernel(4)
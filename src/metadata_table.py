@@ -0,0 +1,74 @@
+import numpy as np
+from typing import Dict, Iterator, List
+
+
+class MetadataTable:
+    """Колоночное (SoA) представление метаданных извлеченных файлов
+
+    Downstream-шагам обычно нужна одна-две колонки за раз (только пути
+    для OCR, только размеры для статистики). Список словарей заставляет
+    каждый проход трогать все поля каждой записи; здесь колонки лежат
+    отдельно, а числовые - непрерывными numpy-массивами, так что фильтры
+    и агрегаты векторизуются.
+    """
+
+    def __init__(self, unique_ids: List[str], extracted_paths: List[str],
+                 archive_sources: List[str], original_names: List[str],
+                 original_paths: List[str], archive_ids: List[str],
+                 file_sizes):
+        self.unique_ids = unique_ids
+        self.extracted_paths = extracted_paths
+        self.archive_sources = archive_sources
+        self.original_names = original_names
+        self.original_paths = original_paths
+        self.archive_ids = archive_ids
+        self.file_sizes = np.asarray(file_sizes, dtype=np.int64)
+
+    @classmethod
+    def from_metadata(cls, metadata: Dict) -> "MetadataTable":
+        """Построение таблицы из metadata.json (AoS -> SoA)"""
+        unique_ids = []
+        extracted_paths = []
+        archive_sources = []
+        original_names = []
+        original_paths = []
+        archive_ids = []
+        file_sizes = []
+
+        for archive in metadata.get("archives", []):
+            for file_info in archive.get("files", []):
+                unique_ids.append(file_info["unique_id"])
+                extracted_paths.append(file_info["extracted_path"])
+                archive_sources.append(file_info["archive_source"])
+                original_names.append(file_info["original_name"])
+                original_paths.append(file_info.get("original_path", ""))
+                archive_ids.append(file_info.get("archive_id", ""))
+                file_sizes.append(file_info.get("file_size", 0))
+
+        return cls(unique_ids, extracted_paths, archive_sources, original_names,
+                   original_paths, archive_ids, file_sizes)
+
+    def __len__(self) -> int:
+        return len(self.unique_ids)
+
+    def total_bytes(self) -> int:
+        """Суммарный размер всех извлеченных файлов"""
+        return int(self.file_sizes.sum())
+
+    def paths_larger_than(self, min_bytes: int) -> List[str]:
+        """Пути файлов крупнее заданного размера (векторизованный фильтр)"""
+        indices = np.flatnonzero(self.file_sizes > min_bytes)
+        return [self.extracted_paths[i] for i in indices]
+
+    def rows(self) -> Iterator[Dict]:
+        """Итерация записями-словарями (совместимость с AoS-потребителями)"""
+        for i in range(len(self.unique_ids)):
+            yield {
+                "unique_id": self.unique_ids[i],
+                "extracted_path": self.extracted_paths[i],
+                "archive_source": self.archive_sources[i],
+                "original_name": self.original_names[i],
+                "original_path": self.original_paths[i],
+                "archive_id": self.archive_ids[i],
+                "file_size": int(self.file_sizes[i]),
+            }
@@ -1,94 +1,238 @@
 import os
-import json
+import orjson
 import cv2
 import numpy as np
 import pytesseract
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from PIL import Image
 from tqdm import tqdm
+import logging
 import config
 
+# Отладочный вывод по каждому изображению идет через logging: print
+# из worker-процессов дерется за stderr с tqdm и замедляет batch OCR.
+# Включается флагом --verbose (уровень DEBUG)
+logger = logging.getLogger(__name__)
+
+try:
+    # In-process биндинг libtesseract: языковые данные загружаются
+    # один раз на процесс, а не на каждую страницу
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+try:
+    # Чтение TIFF без лишних копий: mmap для несжатых сканов,
+    # параллельная декомпрессия полос для Group4
+    import tifffile
+except ImportError:
+    tifffile = None
+
+_TESS_API = None
+
+
+def _get_tess_api():
+    """Ленивое создание PyTessBaseAPI (один экземпляр на процесс)"""
+    global _TESS_API
+    if _TESS_API is None and tesserocr is not None:
+        # PSM.SINGLE_COLUMN - одна колонка текста переменного размера,
+        # OEM.LSTM_ONLY - без legacy-движка (быстрее и точнее на кириллице)
+        _TESS_API = tesserocr.PyTessBaseAPI(
+            lang=config.TESSERACT_LANGUAGES,
+            psm=tesserocr.PSM.SINGLE_COLUMN,
+            oem=tesserocr.OEM.LSTM_ONLY,
+        )
+        _TESS_API.SetVariable("preserve_interword_spaces", "1")
+        _TESS_API.SetVariable("tessedit_use_threads", "0")
+    return _TESS_API
 
-def detect_tiff_type(image_path):
-    """Определяет тип TIFF файла для выбора стратегии обработки"""
-    from PIL import Image
 
+def _init_ocr_worker():
+    """Initializer для ProcessPoolExecutor: прогрев tesseract API в worker'е"""
+    _get_tess_api()
+
+
+def _read_tiff_info(image_path):
+    """Тип TIFF и DPI за одно открытие файла
+
+    PIL читает только заголовок; раньше тип и DPI определялись двумя
+    отдельными Image.open на то же изображение.
+
+    Returns:
+        (tiff_type, dpi, width, height) - dpi может быть None
+    """
     with Image.open(image_path) as img:
-        # Получаем метаданные
         compression = img.info.get("compression", "unknown")
+        dpi_info = img.info.get("dpi")
         width, height = img.size
 
-        # Определяем тип на основе характеристик
-        if "group" in str(compression).lower() or compression == "group4":
-            return "compressed_document"  # Сжатые документы
-        elif compression == "raw" or "none" in str(compression).lower():
-            return "uncompressed_scan"  # Несжатые сканы
+    dpi = int(dpi_info[0]) if dpi_info else None
+
+    # Определяем тип на основе характеристик
+    if "group" in str(compression).lower() or compression == "group4":
+        tiff_type = "compressed_document"  # Сжатые документы
+    elif compression == "raw" or "none" in str(compression).lower():
+        tiff_type = "uncompressed_scan"  # Несжатые сканы
+    else:
+        tiff_type = "standard_tiff"  # Стандартные TIFF
+
+    return tiff_type, dpi, width, height
+
+
+def detect_tiff_type(image_path):
+    """Определяет тип TIFF файла для выбора стратегии обработки"""
+    return _read_tiff_info(image_path)[0]
+
+
+def get_tiff_dpi(image_path):
+    """Чтение DPI из метаданных TIFF (None, если не указан)"""
+    try:
+        return _read_tiff_info(image_path)[1]
+    except Exception:
+        return None
+
+
+# Tesseract'у достаточно ~300 dpi; сканы на 600 dpi несут
+# в 4 раза больше пикселей без прироста точности
+TARGET_OCR_DPI = 300
+
+# Конфигурация tesseract для fallback через pytesseract: фиксирована,
+# собирается один раз на модуль.
+# PSM 4 - одна колонка текста переменного размера;
+# tessedit_use_threads=0 - без внутренних потоков tesseract,
+# чтобы worker-процессы не переподписывали ядра
+CUSTOM_CONFIG = (f"--oem 3 --psm 4 -l {config.TESSERACT_LANGUAGES} "
+                 f"-c preserve_interword_spaces=1 -c tessedit_use_threads=0")
+
+
+def _read_with_tifffile(image_path, tiff_type):
+    """Чтение TIFF через tifffile в grayscale uint8
+
+    Несжатые сканы подключаются как np.memmap (zero-copy, без полного
+    декода в RAM); сжатые декодируются с параллельной распаковкой
+    полос. None - если файл прочитать так не удалось.
+    """
+    try:
+        if tiff_type == "uncompressed_scan":
+            image = tifffile.memmap(image_path, mode='r')
         else:
-            return "standard_tiff"  # Стандартные TIFF
+            image = tifffile.imread(image_path, maxworkers=os.cpu_count())
+    except Exception:
+        return None
 
+    if image.ndim == 3:
+        image = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2GRAY)
 
-def preprocess_image(image_path):
-    """Предобработка изображения для улучшения качества OCR"""
+    if image.dtype == np.bool_:
+        # Битовые Group4-сканы: True -> 255
+        image = image.astype(np.uint8) * 255
+    elif image.dtype != np.uint8:
+        image = cv2.normalize(np.asarray(image), None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+
+    return image
 
-    # Определяем тип TIFF для выбора стратегии
-    tiff_type = detect_tiff_type(image_path)
-    print(f"Тип TIFF: {tiff_type}")
 
-    # Загружаем как grayscale сразу для TIFF файлов
-    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+def preprocess_image(image_path, tiff_info=None):
+    """Предобработка изображения для улучшения качества OCR
+
+    Args:
+        tiff_info: готовый (tiff_type, dpi), чтобы не перечитывать
+            заголовок TIFF повторно
+    """
+
+    # Определяем тип TIFF для выбора стратегии
+    if tiff_info is None:
+        tiff_info = _read_tiff_info(image_path)
+    tiff_type, dpi, header_width, header_height = tiff_info
+    logger.debug(f"Тип TIFF: {tiff_type}")
+
+    # Очень большие сканы читаем сразу уменьшенными: декодер отдает
+    # в 4/16 раз меньше пикселей, и отдельный resize-проход не нужен
+    imread_flag = cv2.IMREAD_GRAYSCALE
+    reduction = 1
+    header_pixels = header_width * header_height
+    if header_pixels >= 16_000_000:
+        imread_flag = cv2.IMREAD_REDUCED_GRAYSCALE_4
+        reduction = 4
+    elif header_pixels >= 8_000_000:
+        imread_flag = cv2.IMREAD_REDUCED_GRAYSCALE_2
+        reduction = 2
+
+    if reduction > 1:
+        logger.debug(f"Чтение с уменьшением в {reduction} раза ({header_pixels:,} пикселей в заголовке)")
+        if dpi:
+            dpi = dpi // reduction
+
+    # Загружаем как grayscale сразу для TIFF файлов;
+    # без уменьшения при чтении предпочитаем tifffile (mmap /
+    # параллельный декод), cv2.imread остается запасным путем
+    image = None
+    if reduction == 1 and tifffile is not None:
+        image = _read_with_tifffile(image_path, tiff_type)
+    if image is None:
+        image = cv2.imread(image_path, imread_flag)
     if image is None:
         raise ValueError(f"Не удалось загрузить изображение: {image_path}")
 
-    print(f"Исходный размер: {image.shape}, среднее значение: {np.mean(image):.1f}")
+    logger.debug(f"Исходный размер: {image.shape}, среднее значение: {np.mean(image):.1f}")
 
     # Проверяем нужна ли инверсия (для WhiteIsZero TIFF)
     if np.mean(image) < 128:
         image = cv2.bitwise_not(image)
-        print("Применена инверсия")
+        logger.debug("Применена инверсия")
 
     # Адаптивное масштабирование в зависимости от размера файла
     height, width = image.shape
     total_pixels = height * width
 
-    print(f"Всего пикселей: {total_pixels:,}")
+    logger.debug(f"Всего пикселей: {total_pixels:,}")
 
     # Целевое разрешение для OCR - как обычный скриншот
     target_pixels = 2_000_000  # ~1414x1414 или 1920x1040
 
-    if total_pixels > target_pixels * 2:  # Очень большие - агрессивно уменьшаем
+    if dpi and dpi > TARGET_OCR_DPI:
+        # DPI известен - точное уменьшение до 300 dpi,
+        # пиксельная нагрузка на LSTM падает в (dpi/300)^2 раз
+        scale_factor = TARGET_OCR_DPI / dpi
+        interpolation = cv2.INTER_AREA
+        logger.debug(f"DPI {dpi} -> {TARGET_OCR_DPI}, масштаб {scale_factor:.2f}")
+    elif total_pixels > target_pixels * 2:  # Очень большие - агрессивно уменьшаем
         scale_factor = 0.4  # Сильно уменьшаем
         interpolation = cv2.INTER_AREA
-        print("Очень большое изображение - сильно уменьшаем")
+        logger.debug("Очень большое изображение - сильно уменьшаем")
     elif total_pixels > target_pixels:  # Большие - уменьшаем
         scale_factor = 0.6  # Умеренно уменьшаем
         interpolation = cv2.INTER_AREA
-        print("Большое изображение - уменьшаем")
+        logger.debug("Большое изображение - уменьшаем")
     elif total_pixels < target_pixels // 4:  # Очень маленькие - увеличиваем
         scale_factor = 2.0  # Увеличиваем маленькие
         interpolation = cv2.INTER_CUBIC
-        print("Маленькое изображение - увеличиваем")
+        logger.debug("Маленькое изображение - увеличиваем")
     else:  # Оптимальный размер - не трогаем
         scale_factor = 1.0
         interpolation = cv2.INTER_LANCZOS4
-        print("Оптимальный размер - не масштабируем")
+        logger.debug("Оптимальный размер - не масштабируем")
 
     if scale_factor != 1.0:
         image = cv2.resize(image, (int(width * scale_factor), int(height * scale_factor)), interpolation=interpolation)
 
-    print(f"Финальный размер: {image.shape}")
+    logger.debug(f"Финальный размер: {image.shape}")
 
     # Адаптивная предобработка
     # Упрощенная предобработка - имитируем качество скриншота
     # Минимальная обработка для сохранения естественности
 
-    # Очень легкий денойзинг только если изображение очень зашумленное
+    # Очень легкий денойзинг только если изображение очень зашумленное.
+    # medianBlur на 2 порядка дешевле fastNlMeansDenoising (O(W*H)
+    # вместо O(W*H*patch^2)) и для бинаризуемых сканов дает тот же эффект
     if total_pixels > 4_000_000:  # Только для больших файлов
-        denoised = cv2.fastNlMeansDenoising(image, h=5)  # Слабый денойзинг
+        denoised = cv2.medianBlur(image, 3)
     else:
         denoised = image  # Маленькие файлы не трогаем
 
     # Простая OTSU бинаризация - как делают современные сканеры
     _, final_thresh = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    print("Использована простая OTSU бинаризация (скриншот-стиль)")
+    logger.debug("Использована простая OTSU бинаризация (скриншот-стиль)")
 
     return final_thresh
 
@@ -97,44 +241,43 @@ def extract_text_from_image(image_path):
     """Извлечение текста из изображения с помощью Tesseract OCR"""
 
     try:
-        processed_image = preprocess_image(image_path)
+        # Заголовок TIFF читается один раз: тип и DPI дальше передаются
+        # по цепочке вместо повторных Image.open
+        tiff_info = _read_tiff_info(image_path)
+        processed_image = preprocess_image(image_path, tiff_info=tiff_info)
 
+        # Гарантируем сплошной буфер: Image.fromarray тогда не делает копию
+        processed_image = np.ascontiguousarray(processed_image)
         pil_image = Image.fromarray(processed_image)
 
-        # Специальные настройки для старых русских документов
-        # PSM 4 - одна колонка текста переменного размера
-        # Добавляем whitelist для кириллических символов
-        # Адаптивная конфигурация tesseract в зависимости от типа файла
-        tiff_type = detect_tiff_type(image_path)
-
-        if tiff_type == "uncompressed_scan":
-            # Для несжатых сканов - консервативные настройки
-            custom_config = f"--oem 3 --psm 4 -l {config.TESSERACT_LANGUAGES} -c preserve_interword_spaces=1"
-        else:
-            # Для сжатых документов - стандартные настройки
-            custom_config = f"--oem 3 --psm 4 -l {config.TESSERACT_LANGUAGES} -c preserve_interword_spaces=1"
+        # Предпочитаем in-process API: без fork-exec бинарника tesseract
+        # и повторной загрузки русской языковой модели на каждую страницу
+        api = _get_tess_api()
+        if api is not None:
+            api.SetImage(pil_image)
+            return api.GetUTF8Text().strip()
 
-        text = pytesseract.image_to_string(pil_image, config=custom_config)
+        text = pytesseract.image_to_string(pil_image, config=CUSTOM_CONFIG)
 
         return text.strip()
 
     except Exception as e:
-        print(f"Ошибка при обработке {image_path}: {str(e)}")
+        logger.warning(f"Ошибка при обработке {image_path}: {str(e)}")
         return ""
 
 
-def process_tiff_file(file_path, output_dir, file_metadata=None):
+def process_tiff_file(file_path, output_dir, file_metadata=None, write_json=True):
     """Обработка одного TIFF файла и сохранение результата в JSON"""
 
     filename = os.path.basename(file_path)
     file_id = os.path.splitext(filename)[0]
 
-    print(f"Обрабатываю файл: {filename}")
+    logger.debug(f"Обрабатываю файл: {filename}")
 
     extracted_text = extract_text_from_image(file_path)
 
     if not extracted_text:
-        print(f"Предупреждение: Текст не извлечен из {filename}")
+        logger.warning(f"Предупреждение: Текст не извлечен из {filename}")
 
     result = {"file_id": file_id, "filename": filename, "text": extracted_text, "text_length": len(extracted_text)}
 
@@ -150,11 +293,15 @@ def process_tiff_file(file_path, output_dir, file_metadata=None):
             }
         )
 
-    output_path = os.path.join(output_dir, f"{file_id}.json")
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(result, f, ensure_ascii=False, indent=2)
+    # При работе из пула результат забирает родительский процесс
+    # и дописывает в общий zstd-шард (write_json=False)
+    if write_json:
+        # Без indent: на горячем пути он удваивает размер и время записи
+        output_path = os.path.join(output_dir, f"{file_id}.json")
+        with open(output_path, "wb") as f:
+            f.write(orjson.dumps(result))
+        logger.debug(f"Результат сохранен: {output_path}")
 
-    print(f"Результат сохранен: {output_path}")
     return result
 
 
@@ -172,19 +319,27 @@ def process_all_files():
         print("TIFF файлы не найдены в папке tiff_reports!")
         return
 
-    print(f"Найдено {len(tiff_files)} TIFF файлов для обработки")
+    workers = os.cpu_count()
+    print(f"Найдено {len(tiff_files)} TIFF файлов для обработки ({workers} процессов)")
 
     results = []
     failed_files = []
 
-    for filename in tqdm(tiff_files, desc="Обработка TIFF файлов"):
-        file_path = os.path.join(source_dir, filename)
-        try:
-            result = process_tiff_file(file_path, output_dir)
-            results.append(result)
-        except Exception as e:
-            print(f"Ошибка при обработке {filename}: {str(e)}")
-            failed_files.append(filename)
+    # OCR независим по файлам: пул процессов загружает все ядра,
+    # память ограничена workers x размер изображения
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_ocr_worker) as executor:
+        futures = {}
+        for filename in tiff_files:
+            file_path = os.path.join(source_dir, filename)
+            futures[executor.submit(process_tiff_file, file_path, output_dir)] = filename
+
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Обработка TIFF файлов"):
+            filename = futures[future]
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"Ошибка при обработке {filename}: {str(e)}")
+                failed_files.append(filename)
 
     summary = {
         "total_files": len(tiff_files),
@@ -243,10 +398,33 @@ def process_test_files():
     return results
 
 
-def process_extracted_files(batch_size=10, resume_from=None):
-    """Обработка файлов извлеченных из архивов с поддержкой checkpoint'ов"""
+def _ocr_one_tiff(file_path, output_dir, file_metadata=None):
+    """Worker для ProcessPoolExecutor: OCR одного TIFF файла
+
+    Возвращает (unique_id, result, error) - результат пишется в JSON
+    внутри process_tiff_file, так что resume-семантика сохраняется.
+    """
+    if file_metadata:
+        unique_id = file_metadata["unique_id"]
+    else:
+        unique_id = os.path.splitext(os.path.basename(file_path))[0]
+
+    try:
+        result = process_tiff_file(file_path, output_dir, file_metadata, write_json=False)
+        return unique_id, result, None
+    except Exception as e:
+        return unique_id, None, str(e)
+
+
+def process_extracted_files(workers=None, resume_from=None):
+    """Обработка файлов извлеченных из архивов с поддержкой checkpoint'ов
+
+    OCR распараллелен по процессам: каждый worker вызывает tesseract
+    независимо, масштабирование почти линейное по физическим ядрам.
+    """
 
     from archive_processor import ArchiveProcessor
+    from text_shard import TextShard
 
     processor = ArchiveProcessor()
     metadata = processor.load_metadata()
@@ -255,71 +433,77 @@ def process_extracted_files(batch_size=10, resume_from=None):
         print("Метаданные архивов не найдены. Сначала запустите обработку архивов.")
         return []
 
-    all_files = processor.get_all_extracted_files()
-    if not all_files:
+    # Колоночное представление метаданных: отбор pending трогает
+    # только нужные колонки, без прохода по всем полям каждой записи
+    table = processor.get_metadata_table()
+    if not len(table):
         print("Извлеченные файлы не найдены.")
         return []
 
     output_dir = config.DATA_PATHS["extracted_text"]
     os.makedirs(output_dir, exist_ok=True)
 
+    workers = workers or os.cpu_count()
+
+    # Результаты пишутся в единый zstd-шард вместо файла-на-TIFF
+    shard = TextShard()
+
     # Поддержка resume - пропускаем уже обработанные файлы
+    # (индекс шарда + legacy per-file JSON)
     processed_files = set()
     if resume_from:
+        processed_files = shard.processed_ids()
         existing_files = [f for f in os.listdir(output_dir) if f.endswith(".json")]
-        processed_files = {os.path.splitext(f)[0] for f in existing_files}
+        processed_files |= {os.path.splitext(f)[0] for f in existing_files}
         print(f"Найдено {len(processed_files)} уже обработанных файлов")
 
-    total_files = len(all_files)
+    total_files = len(table)
     results = []
     failed_files = []
 
-    print(f"Начинаю обработку {total_files} файлов из архивов...")
-    print(f"Размер batch: {batch_size}")
-
-    # Обработка батчами для управления памятью
-    for i in range(0, total_files, batch_size):
-        batch = all_files[i : i + batch_size]
-        batch_num = (i // batch_size) + 1
-        total_batches = (total_files + batch_size - 1) // batch_size
-
-        print(f"\n=== Batch {batch_num}/{total_batches} ({len(batch)} файлов) ===")
-
-        for file_info in tqdm(batch, desc=f"Batch {batch_num}"):
-            unique_id = file_info["unique_id"]
-
-            # Пропускаем уже обработанные
-            if unique_id in processed_files:
-                print(f"Пропускаю {unique_id} (уже обработан)")
-                continue
-
-            file_path = file_info["extracted_path"]
-
-            if not os.path.exists(file_path):
-                print(f"Файл не найден: {file_path}")
+    # Отбираем файлы, которые еще нужно обработать
+    pending = []
+    for i, unique_id in enumerate(table.unique_ids):
+        if unique_id in processed_files:
+            continue
+
+        file_path = table.extracted_paths[i]
+        if not os.path.exists(file_path):
+            print(f"Файл не найден: {file_path}")
+            failed_files.append(unique_id)
+            continue
+
+        archive_metadata = {
+            "unique_id": unique_id,
+            "original_name": table.original_names[i],
+            "original_path": table.original_paths[i],
+            "archive_source": table.archive_sources[i],
+            "archive_id": table.archive_ids[i],
+        }
+        pending.append((file_path, archive_metadata))
+
+    print(f"Начинаю обработку {len(pending)} из {total_files} файлов из архивов...")
+    print(f"Количество worker-процессов: {workers}")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_ocr_worker) as executor:
+        futures = [executor.submit(_ocr_one_tiff, file_path, output_dir, archive_metadata)
+                   for file_path, archive_metadata in pending]
+
+        for future in tqdm(as_completed(futures), total=len(futures), desc="OCR обработка"):
+            unique_id, result, error = future.result()
+            if error is not None:
+                print(f"Ошибка при обработке {unique_id}: {error}")
                 failed_files.append(unique_id)
-                continue
-
-            try:
-                # Передаем метаданные архива
-                archive_metadata = {
-                    "unique_id": unique_id,
-                    "original_name": file_info["original_name"],
-                    "original_path": file_info["original_path"],
-                    "archive_source": file_info["archive_source"],
-                    "archive_id": file_info.get("archive_id", ""),
-                }
-
-                result = process_tiff_file(file_path, output_dir, archive_metadata)
+            else:
+                shard.append(unique_id, result)
                 results.append(result)
                 processed_files.add(unique_id)
 
-            except Exception as e:
-                print(f"Ошибка при обработке {unique_id}: {str(e)}")
-                failed_files.append(unique_id)
+                # Периодический checkpoint индекса шарда
+                if len(results) % 50 == 0:
+                    shard.flush_index()
 
-        # Checkpoint после каждого batch
-        print(f"Batch {batch_num} завершен. Обработано: {len(results)}, ошибок: {len(failed_files)}")
+    shard.flush_index()
 
     # Финальная сводка
     summary = {
@@ -346,16 +530,23 @@ def process_extracted_files(batch_size=10, resume_from=None):
 if __name__ == "__main__":
     import sys
 
+    # --verbose включает отладочный вывод по каждому изображению
+    verbose = "--verbose" in sys.argv
+    if verbose:
+        sys.argv.remove("--verbose")
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.WARNING,
+                        format="%(message)s")
+
     if len(sys.argv) > 1 and sys.argv[1] == "--all":
         print("🚀 ЗАПУСК ОБРАБОТКИ ВСЕХ ФАЙЛОВ!")
         results = process_all_files()
     elif len(sys.argv) > 1 and sys.argv[1] == "--archives":
         print("🗂️ ЗАПУСК ОБРАБОТКИ ФАЙЛОВ ИЗ АРХИВОВ!")
-        batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+        workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
         resume = True if len(sys.argv) > 3 and sys.argv[3] == "--resume" else False
-        results = process_extracted_files(batch_size=batch_size, resume_from=resume)
+        results = process_extracted_files(workers=workers, resume_from=resume)
     else:
         print("🧪 Обработка тестовых файлов")
         print("Для всех файлов: --all")
-        print("Для архивов: --archives [batch_size] [--resume]")
+        print("Для архивов: --archives [workers] [--resume]")
         results = process_test_files()
@@ -1,18 +1,51 @@
+import asyncio
+import functools
 import os
 from typing import List, Dict, Optional
 from search_engine import GeologicalSearchEngine
+from semantic_cache import SemanticCache
 import config
 
 try:
     import openai
+    import httpx  # транзитивная зависимость openai
 except ImportError:
     print("❌ Ошибка: библиотека openai не установлена")
     print("Установите её командой: pip install openai")
     raise
 
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Токенизатор для бюджета контекста: создается один раз на процесс,
+# нужен только чанкам без предрассчитанного token_count
+_TOKEN_ENCODER = tiktoken.get_encoding("cl100k_base") if tiktoken else None
+
+
+@functools.lru_cache(maxsize=4096)
+def _count_tokens(text: str) -> int:
+    """Число cl100k_base-токенов с кэшем по строке
+
+    Одни и те же чанки попадают в контекст разных вопросов; повторная
+    токенизация идентичной строки - это словарный lookup, а не O(len)
+    проход. Без tiktoken - оценка ~3 символа на токен.
+    """
+    if _TOKEN_ENCODER is not None:
+        return len(_TOKEN_ENCODER.encode(text))
+    return len(text) // 3 + 1
+
+
 class GeologicalRAGSystem:
     """RAG система для ответов на вопросы по геологическим документам"""
-    
+
+    # Верхняя граница длины вопроса в символах: аномально длинный ввод
+    # (вставленный документ, мусор) отклоняется сразу, без затрат на
+    # векторизацию, поиск и платный запрос к LLM
+    MAX_QUESTION_CHARS = 2048
+
+
     def __init__(self, openai_api_key: str = None):
         # Настройка OpenAI
         if openai_api_key is None:
@@ -26,7 +59,13 @@ class GeologicalRAGSystem:
         
         # Простая инициализация без дополнительных параметров
         try:
-            self.client = openai.OpenAI(api_key=openai_api_key)
+            # Явный httpx-клиент с keep-alive пулом: соединение с API
+            # прогревается первым запросом и переиспользуется, вместо
+            # TCP+TLS handshake на каждый вопрос
+            self._http_client = httpx.Client(
+                limits=httpx.Limits(max_keepalive_connections=16))
+            self.client = openai.OpenAI(
+                api_key=openai_api_key, http_client=self._http_client)
         except Exception as e:
             # Попробуем альтернативный способ для старых версий
             try:
@@ -40,27 +79,66 @@ class GeologicalRAGSystem:
         
         # Инициализация поисковой системы
         self.search_engine = GeologicalSearchEngine()
-        
+
+        # Семантический кэш: перефразированные повторы вопросов
+        # не ходят в LLM заново
+        self.semantic_cache = SemanticCache()
+
+        # Асинхронный клиент создается лениво при первом ask_question_async
+        # и пересоздается при смене event loop: его keep-alive соединения
+        # привязаны к loop'у, в котором были открыты
+        self._async_client = None
+        self._async_client_loop = None
+
+        # Системное сообщение собирается один раз: байт-в-байт одинаковый
+        # префикс messages включает prompt caching на стороне OpenAI
+        self._system_message = {"role": "system", "content": self.create_system_prompt()}
+
         print("RAG система инициализирована успешно!")
     
     def create_context_from_chunks(self, chunks: List[Dict], max_tokens: int = 6000) -> str:
-        """Создание контекста из найденных чанков с учетом лимита токенов"""
-        context_parts = []
+        """Создание контекста из найденных чанков с учетом лимита токенов
+
+        Фрагменты накапливаются в списке и склеиваются одним join в
+        конце: без промежуточных конкатенаций строка контекста не
+        переписывается в памяти по разу на чанк.
+        """
+        selected = []
         current_length = 0
-        
-        for i, chunk in enumerate(chunks, 1):
-            chunk_text = f"\n--- Документ {chunk['filename']}, фрагмент {chunk['chunk_index']} ---\n{chunk['text']}\n"
-            
-            # Простая оценка количества токенов (примерно 1 токен = 4 символа для русского)
-            estimated_tokens = len(chunk_text) // 4
-            
+
+        for chunk in chunks:
+            header = f"\n--- Документ {chunk['filename']}, фрагмент {chunk['chunk_index']} ---\n"
+
+            # Предрассчитанный на этапе индексации token_count; для
+            # старых индексов считаем токенизатором или оцениваем.
+            # len//4 для кириллицы сильно завышал оценку (cl100k_base
+            # дает 2-3 символа на токен), и бюджет недозаполнялся
+            if chunk.get("token_count") is not None:
+                estimated_tokens = chunk["token_count"] + len(header) // 3 + 1
+            else:
+                estimated_tokens = _count_tokens(header + chunk["text"])
+
             if current_length + estimated_tokens > max_tokens:
                 break
-            
-            context_parts.append(chunk_text)
+
+            selected.append((header, chunk["text"], chunk["chunk_id"]))
             current_length += estimated_tokens
-        
-        return "\n".join(context_parts)
+
+        # Бюджет токенов заполняется по релевантности, но в промпт
+        # фрагменты идут в каноническом порядке (по chunk_id): чанки,
+        # общие для разных вопросов, повторяются в одной и той же
+        # последовательности, и провайдерский кэш промпта их узнает
+        selected.sort(key=lambda item: item[2])
+
+        context_parts = []
+        for header, text, _ in selected:
+            if context_parts:
+                context_parts.append("\n")
+            context_parts.append(header)
+            context_parts.append(text)
+            context_parts.append("\n")
+
+        return "".join(context_parts)
     
     def create_system_prompt(self) -> str:
         """Создание системного промпта для OpenAI"""
@@ -80,105 +158,233 @@ class GeologicalRAGSystem:
 - Если в документах нет ответа на вопрос, так и скажи
 - Не придумывай информацию, которой нет в документах"""
     
-    def ask_question(self, question: str, max_chunks: int = 5, 
-                    min_similarity: float = 0.01) -> Dict:
+    def _build_user_prompt(self, question: str, search_results: List[Dict]) -> str:
+        """Сборка пользовательского промпта из найденных чанков"""
+        context = self.create_context_from_chunks(search_results)
+        return f"""
+Контекст из геологических документов:
+{context}
+
+Вопрос пользователя: {question}
+
+Проанализируй предоставленные документы и дай развернутый ответ на вопрос. Обязательно укажи, из каких документов взята информация.
+"""
+
+    def _question_too_long_response(self, question: str) -> Dict:
+        return {
+            "question": question,
+            "answer": (f"Вопрос слишком длинный ({len(question)} символов, "
+                       f"максимум {self.MAX_QUESTION_CHARS}). "
+                       "Сформулируйте его короче."),
+            "sources": [],
+            "confidence": "низкая",
+            "error": "question_too_long"
+        }
+
+    def _no_results_response(self, question: str) -> Dict:
+        return {
+            "question": question,
+            "answer": "К сожалению, я не нашел релевантной информации в доступных геологических документах для ответа на ваш вопрос.",
+            "sources": [],
+            "confidence": "низкая",
+            "error": None
+        }
+
+    def _build_result(self, question: str, answer: str, search_results: List[Dict]) -> Dict:
+        """Подготовка итогового словаря с ответом и метаинформацией"""
+        sources = []
+        for chunk in search_results:
+            sources.append({
+                "filename": chunk["filename"],
+                "chunk_id": chunk["chunk_id"],
+                "similarity": round(chunk["similarity"], 3)
+            })
+
+        # Оценка уверенности на основе качества найденных документов
+        avg_similarity = sum(chunk["similarity"] for chunk in search_results) / len(search_results)
+        if avg_similarity > 0.3:
+            confidence = "высокая"
+        elif avg_similarity > 0.1:
+            confidence = "средняя"
+        else:
+            confidence = "низкая"
+
+        return {
+            "question": question,
+            "answer": answer,
+            "sources": sources,
+            "confidence": confidence,
+            "chunks_used": len(search_results),
+            "from_cache": False,
+            "error": None
+        }
+
+    def ask_question(self, question: str, max_chunks: int = 5,
+                    min_similarity: float = 0.01, stream_callback=None) -> Dict:
         """
         Задать вопрос системе RAG
-        
+
         Args:
             question: Вопрос пользователя
             max_chunks: Максимальное количество чанков для контекста
             min_similarity: Минимальный порог сходства для включения чанка
-        
+            stream_callback: Функция, вызываемая для каждого фрагмента
+                ответа по мере его генерации (stream=True). Процесс
+                не простаивает сотни мс в ожидании полного ответа
+
         Returns:
             Словарь с ответом и метаинформацией
         """
+        if len(question) > self.MAX_QUESTION_CHARS:
+            return self._question_too_long_response(question)
+
         try:
+            # 0. Векторизуем вопрос один раз: вектор используется и для
+            # семантического кэша, и для поиска
+            query_vector = self.search_engine.vectorize_query(question)
+
+            cached = self.semantic_cache.lookup(query_vector)
+            if cached is not None:
+                cached_result = dict(cached)
+                cached_result["question"] = question
+                cached_result["from_cache"] = True
+                return cached_result
+
             # 1. Поиск релевантных документов
             search_results = self.search_engine.search(
-                question, 
-                top_k=max_chunks, 
-                min_similarity=min_similarity
+                question,
+                top_k=max_chunks,
+                min_similarity=min_similarity,
+                query_vector=query_vector
             )
             
             if not search_results:
-                return {
-                    "question": question,
-                    "answer": "К сожалению, я не нашел релевантной информации в доступных геологических документах для ответа на ваш вопрос.",
-                    "sources": [],
-                    "confidence": "низкая",
-                    "error": None
-                }
-            
-            # 2. Создание контекста
-            context = self.create_context_from_chunks(search_results)
-            
-            # 3. Формирование промпта
-            user_prompt = f"""
-Контекст из геологических документов:
-{context}
+                return self._no_results_response(question)
 
-Вопрос пользователя: {question}
+            # 2-3. Создание контекста и формирование промпта
+            user_prompt = self._build_user_prompt(question, search_results)
 
-Проанализируй предоставленные документы и дай развернутый ответ на вопрос. Обязательно укажи, из каких документов взята информация.
-"""
-            
             # 4. Запрос к OpenAI
             try:
+                messages = [
+                    self._system_message,
+                    {"role": "user", "content": user_prompt}
+                ]
+
                 if hasattr(self, 'use_legacy_api') and self.use_legacy_api:
                     # Старый API
                     response = self.client.ChatCompletion.create(
                         model="gpt-3.5-turbo",
-                        messages=[
-                            {"role": "system", "content": self.create_system_prompt()},
-                            {"role": "user", "content": user_prompt}
-                        ],
+                        messages=messages,
                         max_tokens=1500,
                         temperature=0.3
                     )
                     answer = response.choices[0].message.content.strip()
+                elif stream_callback is not None:
+                    # Потоковый ответ: фрагменты отдаются по мере генерации
+                    response_stream = self.client.chat.completions.create(
+                        model="gpt-3.5-turbo",
+                        messages=messages,
+                        max_tokens=1500,
+                        temperature=0.3,
+                        stream=True
+                    )
+                    answer_parts = []
+                    for event in response_stream:
+                        delta = event.choices[0].delta.content if event.choices else None
+                        if delta:
+                            answer_parts.append(delta)
+                            stream_callback(delta)
+                    answer = "".join(answer_parts).strip()
                 else:
                     # Новый API
                     response = self.client.chat.completions.create(
                         model="gpt-3.5-turbo",
-                        messages=[
-                            {"role": "system", "content": self.create_system_prompt()},
-                            {"role": "user", "content": user_prompt}
-                        ],
+                        messages=messages,
                         max_tokens=1500,
                         temperature=0.3
                     )
                     answer = response.choices[0].message.content.strip()
             except Exception as api_error:
                 raise Exception(f"Ошибка при обращении к OpenAI API: {api_error}")
-            
+
             # 5. Подготовка метаинформации
-            sources = []
-            for chunk in search_results:
-                sources.append({
-                    "filename": chunk["filename"],
-                    "chunk_id": chunk["chunk_id"],
-                    "similarity": round(chunk["similarity"], 3)
-                })
-            
-            # Оценка уверенности на основе качества найденных документов
-            avg_similarity = sum(chunk["similarity"] for chunk in search_results) / len(search_results)
-            if avg_similarity > 0.3:
-                confidence = "высокая"
-            elif avg_similarity > 0.1:
-                confidence = "средняя"
-            else:
-                confidence = "низкая"
-            
+            result = self._build_result(question, answer, search_results)
+
+            self.semantic_cache.add(query_vector, result)
+
+            return result
+
+        except Exception as e:
             return {
                 "question": question,
-                "answer": answer,
-                "sources": sources,
-                "confidence": confidence,
-                "chunks_used": len(search_results),
-                "error": None
+                "answer": f"Произошла ошибка при обработке вопроса: {str(e)}",
+                "sources": [],
+                "confidence": "ошибка",
+                "error": str(e)
             }
-            
+
+    async def ask_question_async(self, question: str, max_chunks: int = 5,
+                                 min_similarity: float = 0.01) -> Dict:
+        """Асинхронный вариант ask_question
+
+        Несколько вопросов в одном event loop перекрывают друг друга
+        по времени ожидания OpenAI: поиск следующего вопроса идет,
+        пока предыдущий ждет ответа LLM.
+        """
+        if len(question) > self.MAX_QUESTION_CHARS:
+            return self._question_too_long_response(question)
+
+        try:
+            query_vector = self.search_engine.vectorize_query(question)
+
+            cached = self.semantic_cache.lookup(query_vector)
+            if cached is not None:
+                cached_result = dict(cached)
+                cached_result["question"] = question
+                cached_result["from_cache"] = True
+                return cached_result
+
+            search_results = self.search_engine.search(
+                question,
+                top_k=max_chunks,
+                min_similarity=min_similarity,
+                query_vector=query_vector
+            )
+
+            if not search_results:
+                return self._no_results_response(question)
+
+            user_prompt = self._build_user_prompt(question, search_results)
+
+            # Клиент кэшируется по текущему event loop: соединения пула
+            # из закрытого loop'а (предыдущий asyncio.run) непригодны и
+            # роняют запрос с "Event loop is closed"
+            loop = asyncio.get_running_loop()
+            if self._async_client is None or self._async_client_loop is not loop:
+                self._async_client = openai.AsyncOpenAI(
+                    api_key=self.client.api_key,
+                    http_client=httpx.AsyncClient(
+                        limits=httpx.Limits(max_keepalive_connections=16)))
+                self._async_client_loop = loop
+
+            response = await self._async_client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[
+                    self._system_message,
+                    {"role": "user", "content": user_prompt}
+                ],
+                max_tokens=1500,
+                temperature=0.3
+            )
+            answer = response.choices[0].message.content.strip()
+
+            result = self._build_result(question, answer, search_results)
+
+            self.semantic_cache.add(query_vector, result)
+
+            return result
+
         except Exception as e:
             return {
                 "question": question,
@@ -187,7 +393,7 @@ class GeologicalRAGSystem:
                 "confidence": "ошибка",
                 "error": str(e)
             }
-    
+
     def interactive_session(self):
         """Интерактивная сессия вопросов-ответов"""
         print("\n=== ИНТЕРАКТИВНАЯ СЕССИЯ ГЕОЛОГИЧЕСКИХ ЗАПРОСОВ ===")
@@ -207,12 +413,24 @@ class GeologicalRAGSystem:
                     continue
                 
                 print("\n🔍 Ищу информацию в документах...")
-                
-                result = self.ask_question(question)
-                
+
                 print(f"\n📋 Ответ:")
                 print("=" * 50)
-                print(result["answer"])
+
+                # Ответ печатается по мере генерации (stream)
+                streamed = []
+
+                def print_delta(delta):
+                    streamed.append(delta)
+                    print(delta, end="", flush=True)
+
+                result = self.ask_question(question, stream_callback=print_delta)
+
+                if streamed:
+                    print()
+                else:
+                    # Кэш или legacy API - ответ пришел целиком
+                    print(result["answer"])
                 print("=" * 50)
                 
                 if result["sources"]:
@@ -1,14 +1,48 @@
 import os
 import pickle
+import threading
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer
+from collections import OrderedDict
 from typing import List, Dict, Tuple
 import config
 
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+try:
+    # SimSIMD не входит в обязательные зависимости: с ней скалярные
+    # произведения идут через AVX-512/NEON-ядра, без нее - numpy/BLAS
+    import simsimd
+except ImportError:
+    simsimd = None
+
+
+
+# Бинарный префильтр окупается только когда полный float32-скан
+# упирается в память; на малых корпусах он лишь добавляет проход
+BINARY_PREFILTER_MIN_ROWS = 20_000
+
+# Таблица popcount по байту - для подсчета расстояния Хэмминга
+# над упакованными знаковыми битами
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+# Кэш векторов запросов общий на процесс: несколько экземпляров движка
+# (поисковые тесты и RAG в одном прогоне) кодируют одни и те же строки.
+# Ключ включает имя модели - индексы разных моделей не пересекаются.
+# Доступ под замком: поиск зовут из пула потоков (параллельные
+# ask_question), а move_to_end/popitem на общем OrderedDict не атомарны
+_QUERY_CACHE = OrderedDict()
+_QUERY_CACHE_LOCK = threading.Lock()
+
 class GeologicalSearchEngine:
     """Поисковая система для геологических документов"""
-    
+
+    # Повторные запросы (уточнение в интерактивном режиме) не должны
+    # заново гонять модель: векторы кэшируются с LRU-вытеснением
+    QUERY_CACHE_SIZE = 1024
+
     def __init__(self, index_path: str = None):
         if index_path is None:
             index_path = os.path.join(config.DATA_PATHS["embeddings"], "search_index.pkl")
@@ -16,6 +50,16 @@ class GeologicalSearchEngine:
         self.index_path = index_path
         self.index_data = None
         self.model = None
+        self.faiss_index = None
+        self.embeddings_bits = None
+        self._dot_kernel = None
+        # Буфер под вектор сходств - thread-local: поиск вызывается
+        # из нескольких потоков (параллельные ask_question), общий
+        # буфер на экземпляр дал бы гонку записи
+        self._sims_local = threading.local()
+        self._row_by_chunk_id = {}
+        self._rows_by_file_id = {}
+        self._pos_in_file = {}
         
         # Загружаем индекс только если он уже существует
         if os.path.exists(self.index_path):
@@ -32,7 +76,8 @@ class GeologicalSearchEngine:
         if not os.path.exists(embeddings_dir):
             raise FileNotFoundError(f"Директория с embeddings не найдена: {embeddings_dir}")
         
-        embedding_files = [f for f in os.listdir(embeddings_dir) if f.endswith('_embeddings.json')]
+        embedding_files = [f for f in os.listdir(embeddings_dir)
+                           if f.endswith(('_embeddings.json', '_embeddings.parquet'))]
         if not embedding_files:
             raise FileNotFoundError("Не найдены файлы с embeddings. Сначала запустите создание embeddings.")
         
@@ -56,69 +101,285 @@ class GeologicalSearchEngine:
         
         with open(self.index_path, 'rb') as f:
             self.index_data = pickle.load(f)
-        
-        # Загружаем модель для векторизации запросов
+
+        # Новый формат индекса: pickle хранит только метаданные, матрица
+        # эмбеддингов лежит рядом в .npy и подключается через mmap без копии
+        if "embeddings_file" in self.index_data:
+            embeddings_path = os.path.join(
+                os.path.dirname(self.index_path), self.index_data["embeddings_file"])
+            embeddings = np.load(embeddings_path, mmap_mode='r')
+
+            # float16-матрица: скан memory-bound, поэтому с simsimd она
+            # остается fp16 в памяти (половина трафика DRAM); без
+            # simsimd поднимается в float32 один раз при загрузке -
+            # считать в fp16 numpy не умеет через BLAS
+            if embeddings.dtype == np.float16 and simsimd is None:
+                embeddings = embeddings.astype(np.float32)
+            elif embeddings.dtype == np.int8:
+                # int8-квантование (EMBEDDING_INDEX_DTYPE="int8"):
+                # деквантуем по сохраненным масштабам один раз
+                embeddings = embeddings.astype(np.float32)
+                scale = self.index_data.get("int8_scale")
+                if scale is not None:
+                    embeddings = embeddings / np.asarray(scale, dtype=np.float32)
+
+            self.index_data["embeddings"] = embeddings
+
+        # Индексы старого формата не нормализованы при построении:
+        # нормализуем матрицу один раз здесь, чтобы на запросе косинус
+        # считался одним GEMV, а не пересчетом норм всего корпуса
+        if not self.index_data.get("normalized"):
+            embeddings = np.ascontiguousarray(
+                self.index_data["embeddings"], dtype=np.float32)
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self.index_data["embeddings"] = embeddings / norms
+            self.index_data["normalized"] = True
+
+        # Упакованные знаковые биты для Хэмминг-префильтра
+        if "bits_file" in self.index_data:
+            bits_path = os.path.join(
+                os.path.dirname(self.index_path), self.index_data["bits_file"])
+            if os.path.exists(bits_path):
+                self.embeddings_bits = np.load(bits_path)
+
+        # faiss-индекс, если он был записан при индексации
+        if faiss is not None and "faiss_file" in self.index_data:
+            faiss_path = os.path.join(
+                os.path.dirname(self.index_path), self.index_data["faiss_file"])
+            if os.path.exists(faiss_path):
+                self.faiss_index = faiss.read_index(faiss_path)
+
+                # GPU-сборка faiss + доступная CUDA-карта: переносим
+                # индекс в видеопамять, скан top-k уходит с CPU на GPU.
+                # CPU-сборка этих функций не имеет - остаемся как есть
+                if (hasattr(faiss, "StandardGpuResources")
+                        and faiss.get_num_gpus() > 0):
+                    try:
+                        self.faiss_index = faiss.index_cpu_to_gpu(
+                            faiss.StandardGpuResources(), 0, self.faiss_index)
+                        print("faiss-индекс перенесен на GPU")
+                    except Exception as e:
+                        print(f"⚠️ Не удалось перенести faiss-индекс на GPU: {e}")
+
+        # Numba-ядро, специализированное под размерность индекса:
+        # компилируется один раз при загрузке, не в первом запросе
+        if self.index_data.get("embedding_dim"):
+            import kernels
+            self._dot_kernel = kernels.make_dot_kernel(self.index_data["embedding_dim"])
+
+        # Справочники по чанкам (один проход): O(1) доступ по chunk_id
+        # и по file_id вместо линейных сканов на каждый вызов
+        chunks = self.index_data["chunks"]
+        self._row_by_chunk_id = {}
+        file_rows = {}
+        for row, chunk in enumerate(chunks):
+            self._row_by_chunk_id[chunk["chunk_id"]] = row
+            file_rows.setdefault(chunk["file_id"], []).append(row)
+        self._rows_by_file_id = {
+            file_id: sorted(rows, key=lambda r: chunks[r]["chunk_index"])
+            for file_id, rows in file_rows.items()}
+        self._pos_in_file = {}
+        for rows in self._rows_by_file_id.values():
+            for pos, row in enumerate(rows):
+                self._pos_in_file[row] = pos
+
+        # Загружаем модель для векторизации запросов - через общий
+        # загрузчик, чтобы запросы кодировались тем же backend'ом
+        # (onnx/fastembed/torch), что и корпус при индексации
+        from embeddings_creator import load_sentence_transformer
+
         model_name = self.index_data["model_name"]
         print(f"Загружаю модель: {model_name}")
-        self.model = SentenceTransformer(model_name)
+        self.model = load_sentence_transformer(model_name)
         
         print(f"Индекс загружен:")
         print(f"- Модель: {self.index_data['model_name']}")
         print(f"- Всего чанков: {self.index_data['total_chunks']}")
         print(f"- Размерность эмбеддингов: {self.index_data['embedding_dim']}")
     
+    def _query_encode_kwargs(self) -> Dict:
+        """Аргументы encode() для кодирования именно запросов
+
+        Fastembed-обертка (FastEmbedEncoder) добавляет e5-префиксы
+        сама, но различает документы и запросы через is_query;
+        без него запрос получил бы префикс \"passage: \", и асимметрия
+        e5 работала бы против поиска. Torch/onnx backend этого
+        аргумента не знает - ему ничего не передаем.
+        """
+        return {"is_query": True} if hasattr(self.model, "_query_prefix") else {}
+
     def vectorize_query(self, query: str) -> np.ndarray:
-        """Векторизация поискового запроса"""
+        """Векторизация поискового запроса (с LRU-кэшем по строке запроса)"""
         if self.model is None:
             raise ValueError("Модель не загружена")
-        
-        query_vector = self.model.encode([query])[0]
+
+        key = (self.index_data["model_name"], query)
+        with _QUERY_CACHE_LOCK:
+            cached = _QUERY_CACHE.get(key)
+            if cached is not None:
+                _QUERY_CACHE.move_to_end(key)
+                return cached
+
+        # Кодирование - вне замка: оно занимает десятки мс, и замок
+        # нужен только на время работы со словарем
+        query_vector = self.model.encode([query], **self._query_encode_kwargs())[0]
+
+        with _QUERY_CACHE_LOCK:
+            _QUERY_CACHE[key] = query_vector
+            if len(_QUERY_CACHE) > self.QUERY_CACHE_SIZE:
+                _QUERY_CACHE.popitem(last=False)
+
         return query_vector
     
-    def search(self, query: str, top_k: int = 5, min_similarity: float = 0.0) -> List[Dict]:
+    def _dot_scores(self, matrix: np.ndarray, q: np.ndarray) -> np.ndarray:
+        """Скалярные произведения строк matrix с вектором q (все нормализованы)
+
+        Приоритет: SimSIMD (AVX-512/NEON, родной fp16-путь) ->
+        numba-ядро, специализированное под размерность индекса ->
+        BLAS GEMV.
+        """
+        if simsimd is not None:
+            # fp16-матрица сканируется fp16-ядрами напрямую (вдвое
+            # меньше трафика DRAM); запрос приводится к типу матрицы
+            if matrix.dtype == np.float16:
+                q = q.astype(np.float16)
+            return 1.0 - np.asarray(simsimd.cdist(q.reshape(1, -1), matrix, "cos"))[0]
+
+        # mmap-матрицу в ядро не передаем: numba не принимает memmap,
+        # а копия в обычный массив на каждый запрос дороже GEMV
+        if (self._dot_kernel is not None and type(matrix) is np.ndarray
+                and matrix.dtype == np.float32 and matrix.flags['C_CONTIGUOUS']):
+            return self._dot_kernel(matrix, q)
+
+        # GEMV пишет в переиспользуемый буфер: без аллокации вектора
+        # сходств (N float32) на каждый запрос
+        if matrix.dtype == np.float32:
+            buf = getattr(self._sims_local, "buf", None)
+            if buf is None or buf.shape[0] != matrix.shape[0]:
+                buf = np.empty(matrix.shape[0], dtype=np.float32)
+                self._sims_local.buf = buf
+            return np.matmul(matrix, q, out=buf)
+
+        return matrix @ q
+
+    def search(self, query: str, top_k: int = 5, min_similarity: float = 0.0,
+               query_vector: np.ndarray = None, ef: int = None) -> List[Dict]:
         """
         Поиск релевантных чанков по запросу
-        
+
         Args:
             query: Поисковый запрос
             top_k: Количество результатов для возврата
             min_similarity: Минимальный порог сходства
-        
+            query_vector: Готовый вектор запроса (чтобы не кодировать повторно)
+            ef: Ширина обхода HNSW-графа (efSearch) для этого запроса;
+                по умолчанию подбирается от top_k. Порог min_similarity
+                сам отсекает хвост, поэтому при строгом пороге хватает
+                небольшого ef
+
         Returns:
             Список релевантных чанков с оценками сходства
         """
         if self.index_data is None:
             raise ValueError("Индекс не загружен")
-        
-        # Векторизация запроса
-        query_vector = self.vectorize_query(query)
-        
-        # Вычисление косинусного сходства
-        similarities = cosine_similarity(
-            query_vector.reshape(1, -1), 
-            self.index_data["embeddings"]
-        )[0]
-        
-        # Сортировка по убыванию сходства
-        ranked_indices = np.argsort(similarities)[::-1]
-        
-        results = []
-        for i, idx in enumerate(ranked_indices):
-            if i >= top_k:
-                break
-            
-            similarity = similarities[idx]
-            if similarity < min_similarity:
-                break
-            
-            chunk = self.index_data["chunks"][idx].copy()
-            chunk["similarity"] = float(similarity)
-            chunk["rank"] = i + 1
-            
-            results.append(chunk)
-        
-        return results
+
+        # Векторизация запроса (если вектор не передан вызывающим кодом)
+        if query_vector is None:
+            query_vector = self.vectorize_query(query)
+
+        # Вычисление косинусного сходства: матрица L2-нормализована
+        # (при индексации либо при загрузке), косинус - это скалярное
+        # произведение
+        q = np.ascontiguousarray(query_vector, dtype=np.float32).ravel()
+        q_norm = np.linalg.norm(q)
+        if q_norm > 0:
+            q = q / q_norm
+
+        if self.faiss_index is not None:
+            # faiss: SIMD-скан inner product по OpenMP-потокам.
+            # Для HNSW-индекса ширина обхода графа задается под запрос:
+            # на маленьких top_k нет смысла в глубоком поиске
+            if hasattr(self.faiss_index, "hnsw"):
+                self.faiss_index.hnsw.efSearch = ef or max(32, top_k * 4)
+            k = min(top_k, self.faiss_index.ntotal)
+            if k == 0:
+                return []
+            scores, indices = self.faiss_index.search(q.reshape(1, -1), k)
+
+            results = []
+            for i, (idx, similarity) in enumerate(zip(indices[0], scores[0])):
+                if idx < 0 or similarity < min_similarity:
+                    break
+                results.append({**self.index_data["chunks"][idx],
+                                "similarity": float(similarity), "rank": i + 1})
+            return results
+
+        embeddings = self.index_data["embeddings"]
+        rows = None
+        if (self.embeddings_bits is not None
+                and embeddings.shape[0] >= BINARY_PREFILTER_MIN_ROWS):
+            # Префильтр: Хэмминг по знаковым битам (XOR + popcount)
+            # отбирает 10*top_k кандидатов, float32-скалярное
+            # произведение пересчитывает только их
+            q_bits = np.packbits(q > 0)
+            hamming = _POPCOUNT[self.embeddings_bits ^ q_bits].sum(axis=1)
+            n_candidates = min(embeddings.shape[0], top_k * 10)
+            rows = np.argpartition(hamming, n_candidates - 1)[:n_candidates]
+            similarities = self._dot_scores(np.ascontiguousarray(embeddings[rows]), q)
+        else:
+            similarities = self._dot_scores(embeddings, q)
+
+        # Частичная сортировка: полный argsort не нужен для top-k.
+        # При заданном пороге сначала отсекаем кандидатов маской -
+        # partition идет по меньшему массиву
+        k = min(top_k, similarities.shape[0])
+        if k == 0:
+            return []
+        if min_similarity > 0.0:
+            candidates = np.flatnonzero(similarities >= min_similarity)
+            if candidates.size == 0:
+                return []
+            k = min(k, candidates.size)
+            top_indices = candidates[np.argpartition(-similarities[candidates], k - 1)[:k]]
+        else:
+            top_indices = np.argpartition(-similarities, k - 1)[:k]
+        ranked_indices = top_indices[np.argsort(-similarities[top_indices])]
+
+        # Сходства ранжированы по убыванию: длина принятого префикса
+        # считается одним сравнением массива, без ветвистого цикла
+        sims_ranked = similarities[ranked_indices]
+        n_keep = int(np.count_nonzero(sims_ranked >= min_similarity))
+        ranked_indices = ranked_indices[:n_keep]
+        result_rows = rows[ranked_indices] if rows is not None else ranked_indices
+
+        chunks = self.index_data["chunks"]
+        return [
+            {**chunks[int(row)], "similarity": float(sims_ranked[r]), "rank": r + 1}
+            for r, row in enumerate(result_rows)]
     
+    def search_batch(self, queries: List[str], top_k: int = 5,
+                     min_similarity: float = 0.0) -> List[List[Dict]]:
+        """Пакетный поиск: все запросы кодируются одним encode
+
+        Кодирование запроса доминирует в латентности коротких запросов,
+        и один батч через модель сильно дешевле пословных вызовов;
+        ранжирование дальше идет обычным путем search() по готовым
+        векторам.
+        """
+        if self.index_data is None:
+            raise ValueError("Индекс не загружен")
+        if not queries:
+            return []
+
+        query_vectors = self.model.encode(
+            queries, batch_size=32, convert_to_numpy=True,
+            **self._query_encode_kwargs())
+
+        return [self.search(query, top_k=top_k, min_similarity=min_similarity,
+                            query_vector=query_vector)
+                for query, query_vector in zip(queries, query_vectors)]
+
     def search_with_details(self, query: str, top_k: int = 5) -> Dict:
         """
         Расширенный поиск с дополнительной информацией
@@ -127,18 +388,18 @@ class GeologicalSearchEngine:
             Словарь с результатами поиска и метаинформацией
         """
         results = self.search(query, top_k)
-        
-        # Группировка результатов по файлам
+
+        # Группировка по файлам и статистика за один проход;
+        # результаты ранжированы по убыванию similarity, так что
+        # максимум - это первый элемент
         files_found = {}
+        similarity_sum = 0.0
         for result in results:
-            file_id = result["file_id"]
-            if file_id not in files_found:
-                files_found[file_id] = []
-            files_found[file_id].append(result)
-        
-        # Статистика
-        avg_similarity = np.mean([r["similarity"] for r in results]) if results else 0
-        max_similarity = max([r["similarity"] for r in results]) if results else 0
+            files_found.setdefault(result["file_id"], []).append(result)
+            similarity_sum += result["similarity"]
+
+        avg_similarity = similarity_sum / len(results) if results else 0
+        max_similarity = results[0]["similarity"] if results else 0
         
         return {
             "query": query,
@@ -163,51 +424,27 @@ class GeologicalSearchEngine:
         Returns:
             Список чанков включая контекст
         """
-        # Находим целевой чанк
-        target_chunk = None
-        target_idx = None
-        
-        for i, chunk in enumerate(self.index_data["chunks"]):
-            if chunk["chunk_id"] == chunk_id:
-                target_chunk = chunk
-                target_idx = i
-                break
-        
-        if target_chunk is None:
+        # Справочники построены при загрузке индекса: целевой чанк,
+        # его соседи по файлу и позиция находятся за O(1) вместо
+        # линейных сканов по всему корпусу
+        row = self._row_by_chunk_id.get(chunk_id)
+        if row is None:
             return []
-        
-        file_id = target_chunk["file_id"]
-        chunk_index = target_chunk["chunk_index"]
-        
-        # Находим все чанки из того же файла
-        file_chunks = []
-        for chunk in self.index_data["chunks"]:
-            if chunk["file_id"] == file_id:
-                file_chunks.append(chunk)
-        
-        # Сортируем по индексу чанка
-        file_chunks.sort(key=lambda x: x["chunk_index"])
-        
-        # Находим позицию целевого чанка в файле
-        target_pos = None
-        for i, chunk in enumerate(file_chunks):
-            if chunk["chunk_id"] == chunk_id:
-                target_pos = i
-                break
-        
-        if target_pos is None:
-            return [target_chunk]
-        
+
+        chunks = self.index_data["chunks"]
+        siblings = self._rows_by_file_id[chunks[row]["file_id"]]
+        target_pos = self._pos_in_file[row]
+
         # Определяем границы контекста
         start = max(0, target_pos - context_size)
-        end = min(len(file_chunks), target_pos + context_size + 1)
-        
-        context_chunks = file_chunks[start:end]
-        
+        end = min(len(siblings), target_pos + context_size + 1)
+
+        context_chunks = [chunks[r] for r in siblings[start:end]]
+
         # Отмечаем целевой чанк
         for chunk in context_chunks:
             chunk["is_target"] = (chunk["chunk_id"] == chunk_id)
-        
+
         return context_chunks
 
 def test_search_engine():
@@ -0,0 +1,100 @@
+import os
+import pickle
+import threading
+import numpy as np
+
+
+class SemanticCache:
+    """Семантический кэш ответов RAG по эмбеддингу вопроса
+
+    Пользователи часто перефразируют одни и те же вопросы; поиск
+    ближайшего кэшированного вопроса по косинусному сходству отдает
+    готовый ответ за ~1 мс вместо полного LLM round-trip (~секунды).
+    Порог 0.95 достаточно строгий, чтобы не отдавать ответ на другой
+    вопрос.
+    """
+
+    # Верхняя граница кэша: при переполнении вытесняется запись,
+    # к которой дольше всего не обращались (LRU)
+    MAX_ENTRIES = 1024
+
+    def __init__(self, cache_dir: str = "data", threshold: float = 0.95):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.vectors_path = os.path.join(cache_dir, "qcache_vectors.npy")
+        self.answers_path = os.path.join(cache_dir, "qcache_answers.pkl")
+        self.threshold = threshold
+
+        # Нормированные векторы вопросов (N, d) и параллельный список ответов
+        self.vectors = None
+        self.answers = []
+
+        if os.path.exists(self.vectors_path) and os.path.exists(self.answers_path):
+            try:
+                self.vectors = np.load(self.vectors_path)
+                with open(self.answers_path, "rb") as f:
+                    self.answers = pickle.load(f)
+            except Exception:
+                self.vectors = None
+                self.answers = []
+
+        # Часы LRU: номер последнего обращения к каждой записи
+        self._clock = len(self.answers)
+        self._last_used = list(range(len(self.answers)))
+
+        # Кэш зовут из пула потоков (параллельные ask_question):
+        # vstack/append/pop должны идти атомарно, иначе vectors
+        # и answers рассинхронизируются
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, query_vector: np.ndarray):
+        """Поиск кэшированного ответа; None при промахе"""
+        qn = self._normalize(query_vector)
+
+        with self._lock:
+            if self.vectors is None or not len(self.answers):
+                return None
+
+            similarities = self.vectors @ qn
+            best = int(np.argmax(similarities))
+
+            if similarities[best] >= self.threshold:
+                self._clock += 1
+                self._last_used[best] = self._clock
+                return self.answers[best]
+            return None
+
+    def add(self, query_vector: np.ndarray, answer: dict):
+        """Добавление свежего ответа в кэш (с сохранением на диск)"""
+        qn = self._normalize(query_vector).reshape(1, -1)
+
+        with self._lock:
+            if self.vectors is None:
+                self.vectors = qn
+            else:
+                self.vectors = np.vstack([self.vectors, qn])
+            self.answers.append(answer)
+            self._clock += 1
+            self._last_used.append(self._clock)
+
+            # LRU-вытеснение: кэш не должен расти безгранично
+            # (каждая запись - вектор вопроса плюс полный ответ)
+            if len(self.answers) > self.MAX_ENTRIES:
+                victim = int(np.argmin(self._last_used))
+                self.vectors = np.delete(self.vectors, victim, axis=0)
+                self.answers.pop(victim)
+                self._last_used.pop(victim)
+
+            # Сохранение под тем же замком: файлы на диске всегда
+            # отражают согласованную пару vectors/answers
+            self.save()
+
+    def save(self):
+        np.save(self.vectors_path, self.vectors)
+        with open(self.answers_path, "wb") as f:
+            pickle.dump(self.answers, f)
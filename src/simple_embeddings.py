@@ -1,7 +1,8 @@
 import os
-import json
+import orjson
 import pickle
 import numpy as np
+from scipy import sparse
 from typing import List, Dict
 from sklearn.feature_extraction.text import TfidfVectorizer
 from tqdm import tqdm
@@ -44,21 +45,34 @@ class SimpleEmbeddingsCreator:
     
     def process_chunks_file(self, file_path: str, output_dir: str):
         """Обработка одного файла с чанками"""
-        with open(file_path, 'r', encoding='utf-8') as f:
-            chunks_data = json.load(f)
-        
+        with open(file_path, 'rb') as f:
+            chunks_data = orjson.loads(f.read())
+
         file_id = os.path.splitext(os.path.basename(file_path))[0].replace('_chunks', '')
         
         print(f"Обрабатываю файл: {file_id} ({len(chunks_data)} чанков)")
         
         chunks_with_embeddings = self.create_embeddings_for_chunks(chunks_data)
-        
-        output_path = os.path.join(output_dir, f"{file_id}_embeddings.json")
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(chunks_with_embeddings, f, ensure_ascii=False, indent=2)
-        
+
+        # Векторы - бинарно в .npz, метаданные - в компактный JSON:
+        # сериализация float-массивов в JSON на порядок медленнее
+        # и примерно втрое толще на диске.
+        # Суффикс _tfidf отделяет эти артефакты от шардов
+        # EmbeddingsCreator: его сканы по *_embeddings.json не должны
+        # принимать TF-IDF метаданные за шарды без векторов
+        embeddings = np.array(
+            [chunk.pop("embedding") for chunk in chunks_with_embeddings],
+            dtype=np.float32)
+        np.savez(os.path.join(output_dir, f"{file_id}_tfidf.npz"),
+                 embeddings=embeddings,
+                 chunk_ids=np.array([c["chunk_id"] for c in chunks_with_embeddings]))
+
+        output_path = os.path.join(output_dir, f"{file_id}_tfidf.json")
+        with open(output_path, 'wb') as f:
+            f.write(orjson.dumps(chunks_with_embeddings))
+
         print(f"Эмбеддинги сохранены: {output_path}")
-        
+
         return len(chunks_data)
     
     def process_all_chunks(self):
@@ -76,14 +90,18 @@ class SimpleEmbeddingsCreator:
         
         print(f"Найдено {len(chunks_files)} файлов с чанками")
         
-        # Сначала собираем все тексты для обучения векторайзера
+        # Один проход по диску: файлы читаются единожды, и собранные
+        # данные используются и для обучения векторайзера, и для
+        # пофайловой выгрузки шардов ниже
         all_texts = []
         all_chunks_data = []
-        
+        per_file_chunks = []
+
         for filename in chunks_files:
             file_path = os.path.join(input_dir, filename)
-            with open(file_path, 'r', encoding='utf-8') as f:
-                chunks_data = json.load(f)
+            with open(file_path, 'rb') as f:
+                chunks_data = orjson.loads(f.read())
+            per_file_chunks.append((filename, chunks_data))
             all_chunks_data.extend(chunks_data)
             all_texts.extend([chunk["text"] for chunk in chunks_data])
         
@@ -96,37 +114,38 @@ class SimpleEmbeddingsCreator:
         total_chunks = 0
         start_idx = 0
         
-        for filename in tqdm(chunks_files, desc="Создание эмбеддингов"):
-            file_path = os.path.join(input_dir, filename)
-            with open(file_path, 'r', encoding='utf-8') as f:
-                chunks_data = json.load(f)
-            
+        for filename, chunks_data in tqdm(per_file_chunks, desc="Создание эмбеддингов"):
             file_id = os.path.splitext(filename)[0].replace('_chunks', '')
             end_idx = start_idx + len(chunks_data)
             
-            # Извлекаем соответствующие эмбеддинги
-            file_embeddings = embeddings_matrix[start_idx:end_idx].toarray()
-            
-            # Добавляем эмбеддинги к чанкам
-            chunks_with_embeddings = []
-            for chunk, embedding in zip(chunks_data, file_embeddings):
-                chunk_with_embedding = chunk.copy()
-                chunk_with_embedding["embedding"] = embedding.tolist()
-                chunk_with_embedding["embedding_dim"] = len(embedding)
-                chunks_with_embeddings.append(chunk_with_embedding)
-            
-            # Сохраняем файл
-            output_path = os.path.join(output_dir, f"{file_id}_embeddings.json")
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(chunks_with_embeddings, f, ensure_ascii=False, indent=2)
+            # Извлекаем соответствующие эмбеддинги; TF-IDF матрица
+            # >95% нулей, поэтому остается разреженной (CSR) - без
+            # .toarray() и 20-кратного раздувания памяти
+            file_embeddings = embeddings_matrix[start_idx:end_idx].tocsr()
+
+            # Векторы - бинарно в .npz, метаданные - отдельным JSON
+            # (суффикс _tfidf: не пересекаемся с шардами EmbeddingsCreator)
+            sparse.save_npz(
+                os.path.join(output_dir, f"{file_id}_tfidf.npz"),
+                file_embeddings)
+
+            chunks_meta = []
+            for chunk in chunks_data:
+                chunk_meta = chunk.copy()
+                chunk_meta["embedding_dim"] = file_embeddings.shape[1]
+                chunks_meta.append(chunk_meta)
+
+            output_path = os.path.join(output_dir, f"{file_id}_tfidf.json")
+            with open(output_path, 'wb') as f:
+                f.write(orjson.dumps(chunks_meta))
             
             total_chunks += len(chunks_data)
             start_idx = end_idx
         
         print(f"\nВсего обработано {total_chunks} чанков")
         
-        # Создаем поисковый индекс
-        self.create_search_index(output_dir, all_chunks_data, embeddings_matrix.toarray())
+        # Создаем поисковый индекс (матрица остается разреженной)
+        self.create_search_index(output_dir, all_chunks_data, embeddings_matrix.tocsr())
         
         return total_chunks
     
@@ -145,18 +164,32 @@ class SimpleEmbeddingsCreator:
                 "chunk_index": chunk["chunk_index"]
             })
         
+        # Матрица эмбеддингов хранится отдельным файлом: pickle копирует
+        # буфер через себя. CSR сохраняется как есть через
+        # scipy.sparse.save_npz; плотная матрица - как .npy под mmap
+        if sparse.issparse(all_embeddings):
+            embeddings_file = "search_index_embeddings_sparse.npz"
+            embeddings_key = "embeddings_sparse_file"
+            sparse.save_npz(os.path.join(embeddings_dir, embeddings_file),
+                            all_embeddings.tocsr())
+        else:
+            embeddings_file = "search_index_embeddings.npy"
+            embeddings_key = "embeddings_file"
+            np.save(os.path.join(embeddings_dir, embeddings_file),
+                    np.asarray(all_embeddings, dtype=np.float32))
+
         index_data = {
             "chunks": index_chunks,
-            "embeddings": all_embeddings,
+            embeddings_key: embeddings_file,
             "vectorizer": self.vectorizer,
             "model_name": "TF-IDF",
             "total_chunks": len(index_chunks),
-            "embedding_dim": all_embeddings.shape[1] if len(all_embeddings) > 0 else 0
+            "embedding_dim": all_embeddings.shape[1] if all_embeddings.shape[0] > 0 else 0
         }
-        
+
         index_path = os.path.join(embeddings_dir, "search_index.pkl")
         with open(index_path, 'wb') as f:
-            pickle.dump(index_data, f)
+            pickle.dump(index_data, f, protocol=5)
         
         print(f"Поисковый индекс создан: {index_path}")
         print(f"Всего чанков в индексе: {len(index_chunks)}")
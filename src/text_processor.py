@@ -1,25 +1,34 @@
 import os
-import json
+import logging
+import orjson
 import re
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
 from typing import List, Dict
 from tqdm import tqdm
 import config
+from kernels import chunk_bounds
+
+logger = logging.getLogger(__name__)
+
+# Regex'ы компилируются один раз на модуль: очистка идет по каждому
+# документу, и перекомпиляция на вызов заметна на большом корпусе.
+# Первые четыре замены слиты в одну альтернацию - непрерывный участок
+# "мусора" (пайпы, линии из _/-, запрещенные символы, пробельные
+# серии) схлопывается в один пробел за единственный проход по строке
+_NOISE_RE = re.compile(r'(?:\s|\||[_\-]{3,}|[^\w\sА-я\.,;:!?\(\)\[\]№%\-/])+')
+_LEADING_PUNCT_RE = re.compile(r'^\s*[\.\-\|]+\s*', re.MULTILINE)
+_BLANK_LINES_RE = re.compile(r'\n\s*\n')
 
 def clean_ocr_text(text: str) -> str:
     """Очистка текста от OCR артефактов"""
-    
-    text = re.sub(r'\|+', ' ', text)
-    
-    text = re.sub(r'[_\-]{3,}', ' ', text)
-    
-    text = re.sub(r'[^\w\sА-я\.,;:!?\(\)\[\]№%\-/]', ' ', text)
-    
-    text = re.sub(r'\s+', ' ', text)
-    
-    text = re.sub(r'^\s*[\.\-\|]+\s*', '', text, flags=re.MULTILINE)
-    
-    text = re.sub(r'\n\s*\n', '\n', text)
-    
+
+    text = _NOISE_RE.sub(' ', text)
+
+    text = _LEADING_PUNCT_RE.sub('', text)
+
+    text = _BLANK_LINES_RE.sub('\n', text)
+
     lines = text.split('\n')
     clean_lines = []
     for line in lines:
@@ -30,49 +39,47 @@ def clean_ocr_text(text: str) -> str:
     return '\n'.join(clean_lines)
 
 def split_text_into_chunks(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-    """Разбивка текста на чанки с перекрытием"""
-    
+    """Разбивка текста на чанки с перекрытием
+
+    Позиции разрывов (пробел, перенос, точка) вычисляются один раз
+    проходом numpy по кодам символов (utf-32: позиция в массиве равна
+    позиции символа в строке). Лучший разрыв для чанка - это просто
+    последний разрыв любого типа перед границей, поэтому массивы
+    слиты в один; границы чанков считает kernels.chunk_bounds
+    (numba-компилируемый цикл с откатом на чистый Python).
+    """
+
     if len(text) <= chunk_size:
         return [text]
-    
+
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    breaks = np.flatnonzero((codes == 0x20) | (codes == 0x0A) | (codes == 0x2E))
+
     chunks = []
-    start = 0
-    
-    while start < len(text):
-        
-        end = min(start + chunk_size, len(text))
-        
-        if end < len(text):
-            last_space = text.rfind(' ', start, end)
-            last_newline = text.rfind('\n', start, end)
-            last_period = text.rfind('.', start, end)
-            
-            best_break = max(last_space, last_newline, last_period)
-            if best_break > start:
-                end = best_break + 1
-        
+    for start, end in chunk_bounds(breaks, len(text), chunk_size, overlap):
         chunk = text[start:end].strip()
         if chunk:
             chunks.append(chunk)
-        
-        if end >= len(text):
-            break
-            
-        start = max(start + chunk_size - overlap, end - overlap)
-    
+
     return chunks
 
 def process_extracted_text_file(file_path: str, output_dir: str) -> Dict:
     """Обработка одного JSON файла с извлеченным текстом"""
-    
-    with open(file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
+
+    with open(file_path, 'rb') as f:
+        data = orjson.loads(f.read())
+
+    return process_extracted_record(data, output_dir)
+
+
+def process_extracted_record(data: Dict, output_dir: str) -> Dict:
+    """Обработка одной записи с извлеченным текстом (из файла или шарда)"""
+
     file_id = data['file_id']
     raw_text = data['text']
-    
-    print(f"Обрабатываю файл: {file_id}")
-    
+
+    logger.debug(f"Обрабатываю файл: {file_id}")
+
     cleaned_text = clean_ocr_text(raw_text)
     
     chunks = split_text_into_chunks(cleaned_text, config.CHUNK_SIZE, config.CHUNK_OVERLAP)
@@ -95,11 +102,11 @@ def process_extracted_text_file(file_path: str, output_dir: str) -> Dict:
         processed_chunks.append(chunk_data)
     
     output_path = os.path.join(output_dir, f"{file_id}_chunks.json")
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(processed_chunks, f, ensure_ascii=False, indent=2)
-    
-    print(f"Создано {len(chunks)} чанков, сохранено: {output_path}")
+    with open(output_path, 'wb') as f:
+        f.write(orjson.dumps(processed_chunks, option=orjson.OPT_INDENT_2))
     
+    logger.debug(f"Создано {len(chunks)} чанков, сохранено: {output_path}")
+
     return {
         "file_id": file_id,
         "chunks_count": len(chunks),
@@ -108,29 +115,78 @@ def process_extracted_text_file(file_path: str, output_dir: str) -> Dict:
     }
 
 def process_all_extracted_texts():
-    """Обработка всех извлеченных текстов"""
-    
+    """Обработка всех извлеченных текстов
+
+    Основной источник - единый zstd-шард (последовательное чтение,
+    без syscall'а на каждый документ); legacy per-file JSON
+    дочитываются для данных, записанных до перехода на шард.
+    """
+    from text_shard import TextShard
+
     input_dir = config.DATA_PATHS["extracted_text"]
     output_dir = config.DATA_PATHS["processed_chunks"]
-    
+
     os.makedirs(output_dir, exist_ok=True)
-    
-    json_files = [f for f in os.listdir(input_dir) if f.endswith('.json')]
-    
-    if not json_files:
-        print("JSON файлы с извлеченным текстом не найдены!")
+
+    shard = TextShard()
+    json_files = []
+    if os.path.isdir(input_dir):
+        json_files = [f for f in os.listdir(input_dir) if f.endswith('.json')]
+
+    if not len(shard) and not json_files:
+        print("Извлеченные тексты не найдены!")
         return
-    
-    print(f"Найдено {len(json_files)} файлов для обработки")
-    
+
+    print(f"Найдено для обработки: {len(shard)} записей в шарде, {len(json_files)} JSON файлов")
+
     results = []
     total_chunks = 0
-    
-    for filename in tqdm(json_files, desc="Обработка текстов"):
-        file_path = os.path.join(input_dir, filename)
-        result = process_extracted_text_file(file_path, output_dir)
-        results.append(result)
-        total_chunks += result["chunks_count"]
+
+    shard_ids = shard.processed_ids()
+
+    # Файлы независимы (чистка regex'ами и чанкинг - CPU-bound),
+    # поэтому обработка идет в пуле процессов, как и OCR-шаг
+    max_workers = os.cpu_count()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Шард читается последовательно (zstd-поток) в родителе,
+        # записи обрабатываются в пуле; в полете держим ограниченное
+        # число записей, чтобы не поднимать весь корпус в память
+        pending = set()
+        progress = tqdm(total=len(shard), desc="Обработка текстов (шард)")
+        for data in shard.iter_records():
+            pending.add(executor.submit(process_extracted_record, data, output_dir))
+            if len(pending) >= max_workers * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    results.append(result)
+                    total_chunks += result["chunks_count"]
+                    progress.update(1)
+        for future in as_completed(pending):
+            result = future.result()
+            results.append(result)
+            total_chunks += result["chunks_count"]
+            progress.update(1)
+        progress.close()
+
+        # Legacy per-file JSON: каждый worker читает свой файл сам,
+        # пропуская файлы, уже присутствующие в шарде
+        futures = {
+            executor.submit(process_extracted_text_file,
+                            os.path.join(input_dir, filename), output_dir): filename
+            for filename in json_files
+            if os.path.splitext(filename)[0] not in shard_ids}
+
+        for future in tqdm(as_completed(futures), total=len(futures),
+                           desc="Обработка текстов"):
+            result = future.result()
+            results.append(result)
+            total_chunks += result["chunks_count"]
+
+    if not results:
+        print("JSON файлы с извлеченным текстом не найдены!")
+        return
     
     summary = {
         "total_files": len(results),
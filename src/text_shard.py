@@ -0,0 +1,86 @@
+import os
+import orjson
+import zstandard
+import config
+
+
+class TextShard:
+    """Единый zstd-шард извлеченных текстов вместо тысяч мелких JSON
+
+    Тысячи файлов по одному на TIFF означают syscall + поиск в каталоге
+    на каждое чтение. Здесь каждая запись - отдельный zstd-фрейм,
+    дописываемый в конец одного файла, плюс индекс
+    {unique_id: [offset, length]} для точечного доступа и resume.
+    Последовательное чтение идет через stream_reader на скорости диска.
+    """
+
+    def __init__(self, shard_path: str = None, index_path: str = None):
+        data_dir = os.path.dirname(config.DATA_PATHS["extracted_text"].rstrip("/"))
+        os.makedirs(data_dir, exist_ok=True)
+
+        self.shard_path = shard_path or os.path.join(data_dir, "extracted_text.ndjson.zst")
+        self.index_path = index_path or os.path.join(data_dir, "extracted_text.index.json")
+
+        self._compressor = zstandard.ZstdCompressor(level=3)
+
+        self._index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                self._index = orjson.loads(f.read())
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, unique_id: str) -> bool:
+        return unique_id in self._index
+
+    def processed_ids(self) -> set:
+        """Множество уже записанных unique_id (для resume)"""
+        return set(self._index)
+
+    def append(self, unique_id: str, record: dict):
+        """Дозапись одной записи (индекс сохраняется отдельно, см. flush_index)"""
+        frame = self._compressor.compress(orjson.dumps(record) + b"\n")
+
+        with open(self.shard_path, "ab") as f:
+            offset = f.tell()
+            f.write(frame)
+
+        self._index[unique_id] = [offset, len(frame)]
+
+    def flush_index(self):
+        """Атомарное сохранение индекса смещений"""
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(self._index))
+        os.replace(tmp_path, self.index_path)
+
+    def get(self, unique_id: str) -> dict:
+        """Точечное чтение записи по индексу (один seek + read)"""
+        offset, length = self._index[unique_id]
+        with open(self.shard_path, "rb") as f:
+            f.seek(offset)
+            frame = f.read(length)
+        return orjson.loads(zstandard.ZstdDecompressor().decompress(frame))
+
+    def iter_records(self):
+        """Последовательная итерация всеми записями шарда"""
+        if not os.path.exists(self.shard_path):
+            return
+
+        with open(self.shard_path, "rb") as f:
+            dctx = zstandard.ZstdDecompressor()
+            with dctx.stream_reader(f, read_across_frames=True) as reader:
+                buffer = b""
+                while True:
+                    chunk = reader.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    buffer += chunk
+                    while b"\n" in buffer:
+                        line, buffer = buffer.split(b"\n", 1)
+                        if line.strip():
+                            yield orjson.loads(line)
+
+                if buffer.strip():
+                    yield orjson.loads(buffer)
@@ -3,15 +3,36 @@
 Тестовый скрипт для проверки RAG системы
 """
 
+import asyncio
+import functools
 import sys
-import os
-
-# Добавляем src в путь
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
 
 import config
 from rag_system import GeologicalRAGSystem
 
+@functools.cache
+def get_rag():
+    """Единственный экземпляр RAG системы на прогон тестов
+
+    Конструктор загружает модель эмбеддингов и поисковый индекс;
+    повторная инициализация в каждой тестовой функции - это секунды
+    холодного старта впустую.
+    """
+    return GeologicalRAGSystem()
+
+def ask_all(rag, questions, **kwargs):
+    """Параллельный прогон списка вопросов через async-клиент
+
+    Вопросы независимы, а время каждого запроса - это почти целиком
+    сетевая задержка OpenAI; asyncio.gather сводит стену времени
+    к максимуму из запросов вместо их суммы.
+    """
+    async def runner():
+        return await asyncio.gather(
+            *[rag.ask_question_async(question, **kwargs) for question in questions])
+
+    return asyncio.run(runner())
+
 def check_openai_key():
     """Проверка наличия OpenAI API ключа"""
     api_key = config.OPENAI_API_KEY
@@ -33,7 +54,7 @@ def test_rag_basic():
     try:
         # Инициализация
         print("🚀 Инициализация RAG системы...")
-        rag = GeologicalRAGSystem()
+        rag = get_rag()
         print("✅ RAG система инициализирована\n")
         
         # Простые тестовые вопросы
@@ -43,12 +64,12 @@ def test_rag_basic():
             "песок и гравий"
         ]
         
-        for question in test_questions:
+        results = ask_all(rag, test_questions, max_chunks=3)
+
+        for question, result in zip(test_questions, results):
             print(f"❓ Тестовый вопрос: '{question}'")
             print("-" * 50)
-            
-            result = rag.ask_question(question, max_chunks=3)
-            
+
             print(f"💬 Ответ получен: {len(result['answer'])} символов")
             print(f"🎯 Уверенность: {result['confidence']}")
             print(f"📚 Источников использовано: {len(result['sources'])}")
@@ -74,7 +95,7 @@ def test_rag_detailed():
     print("=== ДЕТАЛЬНОЕ ТЕСТИРОВАНИЕ RAG ===\n")
     
     try:
-        rag = GeologicalRAGSystem()
+        rag = get_rag()
         
         # Более сложные вопросы
         detailed_questions = [
@@ -83,12 +104,12 @@ def test_rag_detailed():
             "Кто был ответственным за проект в районе реки Протвы?"
         ]
         
-        for question in detailed_questions:
+        results = ask_all(rag, detailed_questions, max_chunks=5, min_similarity=0.01)
+
+        for question, result in zip(detailed_questions, results):
             print(f"❓ Вопрос: {question}")
             print("="*70)
-            
-            result = rag.ask_question(question, max_chunks=5, min_similarity=0.01)
-            
+
             print(f"💬 Полный ответ:")
             print(result['answer'])
             
@@ -118,7 +139,7 @@ def test_edge_cases():
     print("=== ТЕСТИРОВАНИЕ ГРАНИЧНЫХ СЛУЧАЕВ ===\n")
     
     try:
-        rag = GeologicalRAGSystem()
+        rag = get_rag()
         
         edge_cases = [
             "",  # Пустой вопрос
@@ -164,43 +185,76 @@ def performance_test():
     print("=== ТЕСТ ПРОИЗВОДИТЕЛЬНОСТИ ===\n")
     
     try:
+        import statistics
         import time
-        
-        rag = GeologicalRAGSystem()
-        
+
+        rag = get_rag()
+
         question = "месторождение песок гравий"
         num_requests = 3
-        
+
+        # Прогрев: первый запрос платит за холодный старт (модель,
+        # TLS-соединение, кэши) и не должен попадать в статистику
+        warm = rag.ask_question(question, max_chunks=3)
+        if warm["error"]:
+            print(f"   ⚠️ Ошибка: {warm['error']}")
+            return False
+
         print(f"🚀 Выполняю {num_requests} запросов для оценки производительности...")
-        
-        times = []
+
+        # perf_counter_ns монотонен (не зависит от NTP/системных часов);
+        # печать вынесена из измеряемого участка
+        times_ns = []
+        errors = []
         for i in range(num_requests):
-            start_time = time.time()
+            t0 = time.perf_counter_ns()
             result = rag.ask_question(question, max_chunks=3)
-            end_time = time.time()
-            
-            request_time = end_time - start_time
-            times.append(request_time)
-            
-            print(f"   Запрос {i+1}: {request_time:.2f} сек")
-            
-            if result["error"]:
-                print(f"   ⚠️ Ошибка: {result['error']}")
+            times_ns.append(time.perf_counter_ns() - t0)
+            errors.append(result["error"])
+
+        for i, (elapsed_ns, error) in enumerate(zip(times_ns, errors), 1):
+            print(f"   Запрос {i}: {elapsed_ns / 1e9:.2f} сек")
+            if error:
+                print(f"   ⚠️ Ошибка: {error}")
                 return False
-        
-        avg_time = sum(times) / len(times)
+
+        times = sorted(elapsed_ns / 1e9 for elapsed_ns in times_ns)
+        median_time = statistics.median(times)
         print(f"\n📊 Статистика:")
-        print(f"   Среднее время запроса: {avg_time:.2f} сек")
-        print(f"   Минимальное время: {min(times):.2f} сек") 
-        print(f"   Максимальное время: {max(times):.2f} сек")
-        
-        if avg_time < 10:
+        print(f"   Медианное время запроса: {median_time:.2f} сек")
+        print(f"   Минимальное время: {times[0]:.2f} сек")
+        print(f"   Максимальное время: {times[-1]:.2f} сек")
+
+        if median_time < 10:
             print("✅ Производительность хорошая")
-        elif avg_time < 20:
+        elif median_time < 20:
             print("⚠️ Производительность приемлемая")
         else:
             print("❌ Производительность низкая")
-        
+
+        # Пропускная способность: последовательный прогон измеряет
+        # латентность одного потока, а не сколько запросов конвейер
+        # держит в полете одновременно
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+
+        concurrent_requests = 8
+        print(f"\n🚀 Параллельный прогон: {concurrent_requests} одновременных запросов...")
+
+        t0 = time.perf_counter_ns()
+        with ThreadPoolExecutor(max_workers=concurrent_requests) as executor:
+            futures = [executor.submit(rag.ask_question, question, max_chunks=3)
+                       for _ in range(concurrent_requests)]
+            concurrent_results = [future.result() for future in as_completed(futures)]
+        total_time = (time.perf_counter_ns() - t0) / 1e9
+
+        print(f"   Время на {concurrent_requests} запросов: {total_time:.2f} сек "
+              f"({concurrent_requests / total_time:.1f} запросов/сек)")
+
+        failed = [r for r in concurrent_results if r["error"]]
+        if failed:
+            print(f"   ⚠️ Ошибок в параллельном прогоне: {len(failed)}")
+            return False
+
         return True
         
     except Exception as e:
@@ -3,21 +3,28 @@
 Тестовый скрипт для проверки поисковой системы
 """
 
+import functools
 import sys
-import os
-
-# Добавляем src в путь
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
 
 from search_engine import GeologicalSearchEngine
 
+@functools.cache
+def get_search_engine():
+    """Единственный экземпляр поисковой системы на прогон тестов
+
+    Каждый конструктор заново грузит модель и индекс с диска;
+    тестовые функции работают с одними и теми же данными, так что
+    повторная инициализация - чистые накладные расходы.
+    """
+    return GeologicalSearchEngine()
+
 def test_search_simple():
     """Простой тест поиска"""
     print("=== ПРОСТОЙ ТЕСТ ПОИСКА ===\n")
     
     try:
         # Инициализация поисковой системы
-        search_engine = GeologicalSearchEngine()
+        search_engine = get_search_engine()
         
         # Тестовые запросы
         queries = [
@@ -28,12 +35,14 @@ def test_search_simple():
             "геологическая разведка"
         ]
         
-        for query in queries:
+        # Все запросы кодируются одним батчем модели (search_batch),
+        # вместо пяти отдельных forward-проходов
+        all_results = search_engine.search_batch(queries, top_k=3)
+
+        for query, results in zip(queries, all_results):
             print(f"Запрос: '{query}'")
             print("-" * 40)
-            
-            results = search_engine.search(query, top_k=3)
-            
+
             if not results:
                 print("Результатов не найдено")
             else:
@@ -56,7 +65,7 @@ def test_search_detailed():
     print("=== ДЕТАЛЬНЫЙ ТЕСТ ПОИСКА ===\n")
     
     try:
-        search_engine = GeologicalSearchEngine()
+        search_engine = get_search_engine()
         
         query = "месторождение песок гравий Борисово"
         print(f"Детальный поиск по запросу: '{query}'")
@@ -97,7 +106,7 @@ def interactive_search():
     print("Введите 'exit' для выхода\n")
     
     try:
-        search_engine = GeologicalSearchEngine()
+        search_engine = get_search_engine()
         
         while True:
             query = input("Введите поисковый запрос: ").strip()